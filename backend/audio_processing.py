@@ -1,16 +1,33 @@
 import subprocess
 import os
+import queue
+import threading
 import ffmpeg
+import numpy as np
+
+SAMPLE_RATE = 16000
+# Decoded chunks buffered ahead of the consumer; once full, ffmpeg blocks on its pipe
+PCM_QUEUE_CHUNKS = 8
+
+# Probe results keyed by (path, mtime, size) so every stage reuses one ffprobe call
+probe_cache = {}
+probe_cache_lock = threading.Lock()
 
 def get_video_info(video_path):
     try:
+        stat = os.stat(video_path)
+        cache_key = (os.path.abspath(video_path), stat.st_mtime, stat.st_size)
+        with probe_cache_lock:
+            if cache_key in probe_cache:
+                return probe_cache[cache_key]
+
         probe = ffmpeg.probe(video_path)
         streams = probe.get("streams", [])
 
         video_info = next((stream for stream in streams if stream.get("codec_type") == "video"), None)
         audio_info = next((stream for stream in streams if stream.get("codec_type") == "audio"), None)
 
-        return {
+        info = {
             "video_codec": video_info.get("codec_name") if video_info else None,
             "audio_codec": audio_info.get("codec_name") if audio_info else None,
             "format": probe.get("format", {}).get("format_name"),
@@ -19,6 +36,9 @@ def get_video_info(video_path):
             "height": video_info.get("height") if video_info else None,
             "bitrate": probe.get("format", {}).get("bit_rate"),
         }
+        with probe_cache_lock:
+            probe_cache[cache_key] = info
+        return info
 
     except Exception as e:
         return None
@@ -52,4 +72,79 @@ def extract_audio(video_path, output_audio_path="output_audio.wav"):
         return True, output_audio_path
     except subprocess.CalledProcessError as e:
         print("❌ ffmpeg failed:", e)
-        return False, None
\ No newline at end of file
+        return False, None
+
+def pcm_command(video_path, sample_rate=SAMPLE_RATE):
+    return [
+        "ffmpeg",
+        "-nostdin",
+        "-loglevel", "error",
+        "-i", video_path,
+        "-vn",  # disable video
+        "-f", "s16le",  # raw 16-bit PCM instead of a WAV container
+        "-acodec", "pcm_s16le",
+        "-ar", str(sample_rate),
+        "-ac", "1",  # mono channel
+        "pipe:1"
+    ]
+
+def iter_audio_pcm(video_path, chunk_sec=10, sample_rate=SAMPLE_RATE):
+    """
+    Yield the audio track as float32 numpy chunks of `chunk_sec` seconds while ffmpeg
+    is still decoding. A reader thread keeps up to PCM_QUEUE_CHUNKS chunks ready, so
+    decoding runs ahead of the consumer without holding the whole track in memory.
+    """
+    if not os.path.exists(video_path):
+        raise FileNotFoundError(f"Video file not found: {video_path}")
+
+    process = subprocess.Popen(pcm_command(video_path, sample_rate), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    chunk_bytes = int(chunk_sec * sample_rate) * 2
+    chunks = queue.Queue(maxsize=PCM_QUEUE_CHUNKS)
+    stderr_parts = []
+
+    def read_stderr():
+        # Drained on its own, so a verbose ffmpeg never fills the pipe and stalls
+        for line in process.stderr:
+            stderr_parts.append(line)
+
+    def read_pipe():
+        try:
+            while True:
+                data = process.stdout.read(chunk_bytes)
+                if not data:
+                    break
+                chunks.put(data)
+        finally:
+            chunks.put(None)
+
+    reader = threading.Thread(target=read_pipe, name="ffmpeg-pcm-reader", daemon=True)
+    reader.start()
+    stderr_reader = threading.Thread(target=read_stderr, name="ffmpeg-pcm-stderr", daemon=True)
+    stderr_reader.start()
+
+    try:
+        leftover = b""
+        while True:
+            data = chunks.get()
+            if data is None:
+                break
+            data = leftover + data
+            usable = len(data) - len(data) % 2
+            leftover = data[usable:]
+            if usable:
+                yield np.frombuffer(data[:usable], dtype=np.int16).astype(np.float32) / 32768.0
+
+        if process.wait() != 0:
+            stderr_reader.join(timeout=1)
+            raise Exception(f"ffmpeg failed: {b''.join(stderr_parts).decode(errors='ignore')}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        # A consumer that stopped early leaves the reader blocked on the full queue
+        while reader.is_alive():
+            try:
+                chunks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        stderr_reader.join(timeout=1)
@@ -0,0 +1,73 @@
+import argparse
+import os
+import time
+
+import torch
+
+from clip_onnx import CLIP_MODEL_NAME, ONNX_DIR, OnnxClipModel, onnx_paths, sample_inputs
+
+
+def load_backends(output_dir):
+    import clip
+
+    model, _ = clip.load(CLIP_MODEL_NAME, device="cpu", jit=False)
+    backends = {"torch": model.float().eval()}
+    for name, quantized in (("onnx", False), ("onnx-int8", True)):
+        if all(os.path.exists(path) for path in onnx_paths(output_dir, quantized=quantized)):
+            backends[name] = OnnxClipModel(output_dir, quantized=quantized)
+        else:
+            print(f"[INFO] Skipping {name}, run `python clip_onnx.py export` first")
+    return backends
+
+
+def repeat_to(batch, size):
+    # Tile the sample inputs up to the requested batch size
+    repeats = -(-size // len(batch))
+    return batch.repeat(repeats, *([1] * (batch.dim() - 1)))[:size]
+
+
+def time_batch(encode, batch, repeat):
+    with torch.no_grad():
+        encode(batch)  # warm-up, ORT and torch both allocate on the first call
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            encode(batch)
+            timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def benchmark(output_dir=ONNX_DIR, image_dir=None, batch_sizes=(1, 8, 32), repeat=5):
+    backends = load_backends(output_dir)
+    tokens, pixels = sample_inputs(image_dir)
+
+    results = {}
+    for tower, inputs in (("text", tokens), ("image", pixels)):
+        for batch_size in batch_sizes:
+            batch = repeat_to(inputs, batch_size)
+            for name, model in backends.items():
+                encode = model.encode_text if tower == "text" else model.encode_image
+                elapsed = time_batch(encode, batch, repeat)
+                results[(tower, batch_size, name)] = elapsed
+                print(f"{tower:>5} batch {batch_size:>3} {name:>10}: {elapsed * 1000:8.1f} ms/batch, {elapsed * 1000 / batch_size:6.1f} ms/item")
+
+            baseline = results[(tower, batch_size, "torch")]
+            speedups = ", ".join(
+                f"{name} {baseline / results[(tower, batch_size, name)]:.2f}x"
+                for name in backends if name != "torch"
+            )
+            if speedups:
+                print(f"{'':>21}speedup vs torch: {speedups}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare per-batch CLIP latency for the torch and ONNX backends.")
+    parser.add_argument("--output-dir", default=ONNX_DIR, help="Folder with the exported ONNX models")
+    parser.add_argument("--images", help="Folder of sample images; smooth synthetic images are used when omitted")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    benchmark(args.output_dir, args.images, batch_sizes=args.batch_sizes, repeat=args.repeat)
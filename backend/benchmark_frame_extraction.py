@@ -0,0 +1,86 @@
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from extract_scenes_from_video import plan_sample_frames, read_frames_seek, read_frames_sequential
+
+
+def make_test_clip(output_path, duration=120, fps=30, size="854x480", gop=250):
+    """
+    Generate a synthetic H.264 clip with ffmpeg's testsrc pattern.
+    """
+    command = [
+        "ffmpeg",
+        "-f", "lavfi",
+        "-i", f"testsrc=duration={duration}:size={size}:rate={fps}",
+        "-c:v", "libx264",
+        "-g", str(gop),  # keyframe interval, seeks re-decode up to this many frames
+        "-pix_fmt", "yuv420p",
+        output_path,
+        "-y"
+    ]
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return output_path
+
+
+def run_reader(reader, video_path, plan):
+    cap = cv2.VideoCapture(video_path)
+    start = time.perf_counter()
+    frames = [(frame_id, frame) for _, _, frame_id, frame in reader(cap, plan)]
+    elapsed = time.perf_counter() - start
+    cap.release()
+    return elapsed, frames
+
+
+def benchmark(video_path, num_scenes=10, fps=0.5, repeat=3):
+    cap = cv2.VideoCapture(video_path)
+    original_fps = cap.get(cv2.CAP_PROP_FPS)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    # Equal-length synthetic scenes so the benchmark does not depend on scene detection
+    bounds = np.linspace(0, total_frames, num_scenes + 1).astype(int)
+    scene_ranges = list(zip(bounds[:-1], bounds[1:]))
+    plan = plan_sample_frames(scene_ranges, max(1, int(original_fps / fps)))
+
+    results = {}
+    for name, reader in [("seek", read_frames_seek), ("sequential", read_frames_sequential)]:
+        timings = []
+        for _ in range(repeat):
+            elapsed, frames = run_reader(reader, video_path, plan)
+            timings.append(elapsed)
+        results[name] = (min(timings), frames)
+        print(f"{name:>10}: {min(timings):.3f}s best of {repeat}, {len(frames)} frames")
+
+    seek_frames = results["seek"][1]
+    sequential_frames = results["sequential"][1]
+    same_ids = [f for f, _ in seek_frames] == [f for f, _ in sequential_frames]
+    max_diff = max(
+        (int(np.abs(a.astype(np.int16) - b.astype(np.int16)).max()) for (_, a), (_, b) in zip(seek_frames, sequential_frames)),
+        default=0
+    )
+    print(f"Same frame ids: {same_ids}, max pixel difference: {max_diff}")
+    print(f"Speedup: {results['seek'][0] / results['sequential'][0]:.2f}x")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare seek-based and sequential frame sampling.")
+    parser.add_argument("--video", help="Existing video to benchmark; a testsrc clip is generated when omitted")
+    parser.add_argument("--duration", type=int, default=120, help="Length of the generated clip in seconds")
+    parser.add_argument("--scenes", type=int, default=10)
+    parser.add_argument("--fps", type=float, default=0.5, help="Sampling rate in frames per second")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.video:
+        benchmark(args.video, num_scenes=args.scenes, fps=args.fps, repeat=args.repeat)
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            clip_path = make_test_clip(os.path.join(tmp_dir, "testsrc.mp4"), duration=args.duration)
+            benchmark(clip_path, num_scenes=args.scenes, fps=args.fps, repeat=args.repeat)
@@ -0,0 +1,113 @@
+import argparse
+import time
+
+import chromadb
+import numpy as np
+
+# Same index settings as the img_text_emb collection in chromadb_functions.py
+HNSW_CONFIGURATION = {
+    "space": "cosine",
+    "ef_construction": 200,
+    "max_neighbors": 32,
+}
+
+
+def make_corpus(num_videos=200, vectors_per_video=500, dim=512, spread=0.8, seed=0):
+    """
+    Synthetic library: every video's vectors scatter around its own center, so
+    neighbours cluster per video the way real frames and transcript windows do.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(num_videos, dim))
+    vectors = np.repeat(centers, vectors_per_video, axis=0) + spread * rng.normal(size=(num_videos * vectors_per_video, dim))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    video_ids = np.repeat(np.arange(num_videos), vectors_per_video)
+    return vectors.astype(np.float32), video_ids, centers
+
+
+def make_queries(centers, num_queries=200, spread=1.2, seed=1):
+    rng = np.random.default_rng(seed)
+    picked = centers[rng.integers(0, len(centers), size=num_queries)]
+    queries = picked + spread * rng.normal(size=picked.shape)
+    return (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+
+
+def build_collection(client, vectors, video_ids, ef_search, batch_size=5000):
+    name = f"bench_ef{ef_search}"
+    try:
+        client.delete_collection(name)
+    except Exception:
+        pass
+
+    collection = client.create_collection(name=name, configuration={"hnsw": dict(HNSW_CONFIGURATION, ef_search=ef_search)})
+    start = time.perf_counter()
+    for index in range(0, len(vectors), batch_size):
+        end = min(index + batch_size, len(vectors))
+        collection.add(
+            ids=[str(i) for i in range(index, end)],
+            embeddings=vectors[index:end],
+            metadatas=[{"video_url": f"video_{video_ids[i]}"} for i in range(index, end)]
+        )
+    print(f"[INFO] Indexed {len(vectors)} vectors with ef_search={ef_search} in {time.perf_counter() - start:.1f}s")
+    return collection
+
+
+def brute_force(vectors, queries, k):
+    start = time.perf_counter()
+    scores = queries @ vectors.T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top = np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+    elapsed = (time.perf_counter() - start) / len(queries)
+    return top, elapsed
+
+
+def percentile_ms(timings, q):
+    return float(np.percentile(timings, q) * 1000)
+
+
+def benchmark(num_videos=200, vectors_per_video=500, dim=512, num_queries=200, k=10, ef_search_values=(100,), multipliers=(1, 2, 4, 8, 16)):
+    vectors, video_ids, centers = make_corpus(num_videos, vectors_per_video, dim)
+    queries = make_queries(centers, num_queries)
+
+    truth, brute_elapsed = brute_force(vectors, queries, k)
+    print(f"Brute force numpy: {brute_elapsed * 1000:.2f} ms/query over {len(vectors)} vectors")
+
+    client = chromadb.EphemeralClient()
+    results = []
+    for ef_search in ef_search_values:
+        collection = build_collection(client, vectors, video_ids, ef_search)
+        for multiplier in multipliers:
+            n_candidates = k * multiplier
+            timings = []
+            recalls = []
+            for query, expected in zip(queries, truth):
+                start = time.perf_counter()
+                result = collection.query(query_embeddings=[query], n_results=n_candidates, include=["distances"])
+                timings.append(time.perf_counter() - start)
+                found = [int(tmp_id) for tmp_id in result["ids"][0][:k]]
+                recalls.append(len(set(found) & set(expected.tolist())) / k)
+
+            row = {
+                "ef_search": ef_search,
+                "candidates": n_candidates,
+                "recall": float(np.mean(recalls)),
+                "p50_ms": percentile_ms(timings, 50),
+                "p95_ms": percentile_ms(timings, 95),
+            }
+            results.append(row)
+            print(f"ef_search {ef_search:>4} candidates {n_candidates:>4}: recall@{k} {row['recall']:.3f}, p50 {row['p50_ms']:.2f} ms, p95 {row['p95_ms']:.2f} ms")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall vs latency of global HNSW search against brute-force ground truth.")
+    parser.add_argument("--videos", type=int, default=200)
+    parser.add_argument("--vectors-per-video", type=int, default=500)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[100], help="Index ef_search values; each one builds its own collection")
+    parser.add_argument("--multipliers", type=int, nargs="+", default=[1, 2, 4, 8, 16], help="Candidates fetched per query, as multiples of k")
+    args = parser.parse_args()
+
+    benchmark(args.videos, args.vectors_per_video, args.dim, args.queries, args.k, args.ef_search, args.multipliers)
@@ -1,134 +1,218 @@
 import chromadb
-from image_text_emb import get_text_embbeding, get_image_embeddings_batch
+from image_text_emb import get_text_embeddings_batched
 import os
-import pandas as pd
+import numpy as np
+from metrics import timed_phase, ingest_phase_seconds, ingest_items_total
 
 client = chromadb.PersistentClient(path="./store_emb")
 
+# Number of vectors written per upsert call; larger chunks mean fewer HNSW updates
+DB_WRITE_BATCH_SIZE = 1024
+# Size of the HNSW candidate list, fixed when the index is loaded; only applies to a
+# newly created collection. Queries asking for more results search wider anyway.
+HNSW_EF_SEARCH = int(os.environ.get("HNSW_EF_SEARCH", "100"))
+
 collection = client.get_or_create_collection(
     name="img_text_emb", 
     configuration={
         "hnsw": {
             "space": "cosine",
             "ef_construction": 200,
+            "ef_search": HNSW_EF_SEARCH,
             "max_neighbors":32
         }
     }
 )
 
-def check_url_in_db(video_url):
-    try:
-        query_result = collection.get(
-            where={"video_url": video_url},
-        )
+# One record per modality of a video whose vectors were all written; vectors alone
+# may be the leftovers of an ingest that stopped half way
+ingest_status = client.get_or_create_collection(name="ingest_status")
 
-        num_result = len(query_result["ids"])
+def completion_marker_id(video_url, obj):
+    return f"{video_url}_{obj}_complete"
 
-        if num_result == 0:
-            return True, False, "Success"
-        else:
-            return True, True, "Success"
+def mark_modality_complete(video_url, obj, count):
+    """
+    Record that all `count` vectors of one modality of a video were written.
+    """
+    try:
+        ingest_status.upsert(
+            ids=[completion_marker_id(video_url, obj)],
+            # The status collection is only read by id, the embedding is a placeholder
+            embeddings=[[1.0]],
+            metadatas=[{"video_url": video_url, "obj": obj, "count": int(count)}]
+        )
+        return True, "Success"
     except Exception as e:
-        return False, False, f"Error: {e}"
+        return False, f"Error: {e}"
 
-def save_emb_in_db(emb, metadata, id):
+def get_video_modalities(video_url):
+    """
+    Which modalities of a video were completely ingested, as {"text": bool, "image": bool}.
+    """
     try:
-        collection.add(
-            embeddings=emb,
-            metadatas=metadata,
-            ids=id
+        query_result = ingest_status.get(
+            ids=[completion_marker_id(video_url, obj) for obj in ("text", "image")],
+            include=["metadatas"]
         )
-        
-        # Verify by querying
-        result = collection.get(ids=id)
-        if result and result['ids']:
-            return True, "Success"
-        else:
-            return False, "Embedding not found after insertion"
+        done = {metadata["obj"] for metadata in query_result["metadatas"]}
+        present = {obj: obj in done for obj in ("text", "image")}
+        return True, present, "Success"
+    except Exception as e:
+        return False, None, f"Error: {e}"
+
+def delete_video_emb_from_db(video_url, obj=None):
+    try:
+        where = {"video_url": video_url}
+        if obj is not None:
+            # Only one modality, e.g. the leftovers of a partially written branch
+            where = {"$and": [where, {"obj": obj}]}
+        # Drop the marker first, so a failure half way never leaves a video marked complete
+        ingest_status.delete(where=where)
+        collection.delete(where=where)
+        return True, "Success"
     except Exception as e:
         return False, f"Error: {e}"
 
-def save_text_emb_in_db(text_segments, video_url):
+def normalize_embeddings(embs):
+    # CLIP image features come out unnormalized; every stored vector gets unit length
+    embs = np.asarray(embs, dtype=np.float32)
+    if embs.size == 0:
+        return embs
+    return embs / np.maximum(np.linalg.norm(embs, axis=-1, keepdims=True), 1e-12)
+
+def save_emb_batch_in_db(embs, metadatas, ids, batch_size=DB_WRITE_BATCH_SIZE):
+    """
+    Normalize embeddings, upsert them in chunks of `batch_size` and verify each
+    chunk by count.
+
+    Returns (status, failed_batches, message) where failed_batches is a list of
+    {"start", "end", "message"} dicts describing the chunks that did not land.
+    """
+    failed_batches = []
     try:
+        if not (len(embs) == len(metadatas) == len(ids)):
+            raise Exception("Embeddings, metadatas and ids must have the same length")
+        embs = normalize_embeddings(embs)
+
+        for start in range(0, len(ids), batch_size):
+            end = min(start + batch_size, len(ids))
+            batch_ids = ids[start:end]
+            try:
+                with timed_phase(ingest_phase_seconds, "db_write"):
+                    collection.upsert(
+                        embeddings=embs[start:end],
+                        metadatas=metadatas[start:end],
+                        ids=batch_ids
+                    )
+
+                    # Verify the whole chunk with a single count instead of a get per row
+                    result = collection.get(ids=batch_ids, include=[])
+                ingest_items_total.inc(len(batch_ids), phase="db_write")
+                found = len(result["ids"]) if result else 0
+                if found != len(batch_ids):
+                    raise Exception(f"{len(batch_ids) - found} of {len(batch_ids)} embeddings not found after upsert")
+            except Exception as e:
+                print(f"[WARN] Batch {start}:{end} failed: {e}")
+                failed_batches.append({"start": start, "end": end, "message": f"Error: {e}"})
+
+        if failed_batches:
+            failed_rows = sum(batch["end"] - batch["start"] for batch in failed_batches)
+            return False, failed_batches, f"{len(failed_batches)} batch(es) failed, {failed_rows} embeddings not saved"
+
+        return True, failed_batches, "Success"
+    except Exception as e:
+        return False, failed_batches, f"Error: {e}"
+
+def save_text_emb_in_db(text_segments, video_url, batch_size=DB_WRITE_BATCH_SIZE, extra_metadata=None):
+    """
+    `extra_metadata` (e.g. channel, duration, ingested_at) is added to every vector.
+    """
+    try:
+        if not text_segments:
+            # Nothing was said in the video, there is nothing to embed
+            return True, "Success"
+
         texts = [seg["text"] for seg in text_segments]
-        extract_text_emb_status, extract_text_emb, extract_text_emb_message = get_text_embbeding(texts)
+        extract_text_emb_status, extract_text_emb, split_parts, extract_text_emb_message = get_text_embeddings_batched(texts)
 
         if not extract_text_emb_status:
             raise Exception(extract_text_emb_message)
 
-        fail_emb_insert = 0
-        final_message = ""
-
-        for index, (tmp_obj, tmp_emb) in enumerate(zip(text_segments, extract_text_emb)):
-    
+        embs = []
+        metadatas = []
+        ids = []
+        for index, (tmp_obj, tmp_emb, tmp_parts) in enumerate(zip(text_segments, extract_text_emb, split_parts)):
+            embs.append(tmp_emb)
             tmp_metadata = {
                 "obj": 'text', 
                 "text": tmp_obj["text"],
                 "video_url": video_url,
-                "start": tmp_obj["start"]
+                "start": tmp_obj["start"],
+                "split_parts": tmp_parts
             }
-            tmp_id = f"{video_url}_{index}_text"
-            tmp_insert_status, tmp_insert_message = save_emb_in_db([tmp_emb.tolist()], tmp_metadata, tmp_id)
-            if tmp_insert_status == False:
-                fail_emb_insert += 1
-                final_message = tmp_insert_message
+            if "end" in tmp_obj:
+                tmp_metadata["end"] = tmp_obj["end"]
+            tmp_metadata.update(extra_metadata or {})
+            metadatas.append(tmp_metadata)
+            ids.append(f"{video_url}_{index}_text")
 
-        if fail_emb_insert > 0:
-            raise Exception(final_message)
+        insert_status, failed_batches, insert_message = save_emb_batch_in_db(embs, metadatas, ids, batch_size=batch_size)
+        if not insert_status:
+            raise Exception(insert_message)
 
         return True, "Success"
     except Exception as e:
         return False, f"Error: {e}"
 
-def save_img_emb_in_db(scenes_img_folder_path, scenes_csv_path, video_url):
+def save_frame_batches_in_db(emb_batches, video_url, batch_size=DB_WRITE_BATCH_SIZE, extra_metadata=None):
+    """
+    Write already encoded (metadata_list, embeddings) batches of frames.
+    """
     try:
-
-        if not os.path.exists(scenes_img_folder_path):
-            raise Exception("Scenes image folder is not found")
-        
-        if not os.path.exists(scenes_csv_path):
-            raise Exception("Scenes metadata csv is not found")
-        
-        
-        fail_emb_insert = 0
+        embs = []
+        metadatas = []
+        ids = []
+        failed_rows = 0
         final_message = ""
-        
-        df = pd.read_csv(scenes_csv_path)
-        image_path_list = df["file_name"]
-        image_path_list = [os.path.join(scenes_img_folder_path, tmp_file_name) for tmp_file_name in image_path_list]
-
-        img_emb = get_image_embeddings_batch(image_path_list)
-
-        for index, ((i,row), tmp_img_emb) in enumerate(zip(df.iterrows(), img_emb[1])):
-            start_timestamp = row["timestamp_sec"]
-            tmp_file_name = row["file_name"]
-            tmp_image_path = os.path.join(scenes_img_folder_path, tmp_file_name)
-            if not os.path.exists(tmp_image_path):
-                fail_emb_insert += 1
-                continue
-            
-            tmp_metadata = {
-                "obj":"image", 
-                "scene":  int(row["scene"]),
-                "frame_id": int(row["frame_id"]),   
-                "start": int(start_timestamp),
-                "video_url": video_url,
-            }
-            tmp_id = f"{video_url}_{index}_image"
-            tmp_insert_status, tmp_insert_message = save_emb_in_db(tmp_img_emb, tmp_metadata, tmp_id)
-            if tmp_insert_status == False:
-                fail_emb_insert += 1
-                final_message = tmp_insert_message
-        
-        if fail_emb_insert > 0:
-            final_message = f"fail emb insert > 0, {fail_emb_insert}"
-            print("**********************")
-            print(f"fail emb insert > 0, {fail_emb_insert}")
-            print("**********************")
-
-            # raise Exception(final_message)
-        
+        index = 0
+
+        def flush():
+            nonlocal embs, metadatas, ids, failed_rows, final_message
+            insert_status, failed_batches, insert_message = save_emb_batch_in_db(embs, metadatas, ids, batch_size=batch_size)
+            if not insert_status:
+                failed_rows += sum(batch["end"] - batch["start"] for batch in failed_batches)
+                final_message = insert_message
+            embs, metadatas, ids = [], [], []
+
+        for batch_metadata, batch_emb in emb_batches:
+            for frame_metadata, tmp_img_emb in zip(batch_metadata, batch_emb):
+                tmp_metadata = {
+                    "obj":"image", 
+                    "scene":  int(frame_metadata["scene"]),
+                    "frame_id": int(frame_metadata["frame_id"]),   
+                    "start": int(frame_metadata["timestamp_sec"]),
+                    "video_url": video_url,
+                }
+                if "end_sec" in frame_metadata:
+                    # Time range covered by this frame after near-duplicate suppression
+                    tmp_metadata["end"] = int(frame_metadata["end_sec"])
+                tmp_metadata.update(extra_metadata or {})
+                embs.append(tmp_img_emb)
+                metadatas.append(tmp_metadata)
+                ids.append(f"{video_url}_{index}_image")
+                index += 1
+
+            if len(ids) >= batch_size:
+                flush()
+
+        if ids:
+            flush()
+
+        if failed_rows > 0:
+            print(f"[WARN] {failed_rows} frame embeddings of {video_url} not saved: {final_message}")
+            return False, f"{failed_rows} embeddings not saved: {final_message}"
+
         return True, "Success"
     except Exception as e:
         return False, f"Error: {e}"
-
@@ -0,0 +1,247 @@
+import os
+import argparse
+
+import numpy as np
+import torch
+
+CLIP_MODEL_NAME = "ViT-B/32"
+ONNX_DIR = os.environ.get("CLIP_ONNX_DIR", "./onnx_models")
+ONNX_OPSET = 17
+# Intra-op threads per ONNX Runtime session; 0 lets ORT decide
+ONNX_NUM_THREADS = int(os.environ.get("ONNX_NUM_THREADS", "0"))
+
+# Minimum cosine similarity between PyTorch and ONNX embeddings of the same input
+PARITY_THRESHOLDS = {
+    "fp32": 0.999,
+    "int8": 0.98,
+}
+
+IMAGE_SIZE = 224
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+
+
+def onnx_paths(output_dir=ONNX_DIR, quantized=False):
+    suffix = ".int8.onnx" if quantized else ".onnx"
+    return (
+        os.path.join(output_dir, f"clip_text{suffix}"),
+        os.path.join(output_dir, f"clip_image{suffix}"),
+    )
+
+
+def clip_preprocess(n_px=IMAGE_SIZE):
+    # Same transform as clip.load's preprocess, without loading the PyTorch weights
+    from torchvision.transforms import Compose, Resize, CenterCrop, ToTensor, Normalize, InterpolationMode
+
+    return Compose([
+        Resize(n_px, interpolation=InterpolationMode.BICUBIC),
+        CenterCrop(n_px),
+        lambda image: image.convert("RGB"),
+        ToTensor(),
+        Normalize(CLIP_MEAN, CLIP_STD),
+    ])
+
+
+class TextTower(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, tokens):
+        return self.model.encode_text(tokens)
+
+
+class ImageTower(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixels):
+        return self.model.encode_image(pixels)
+
+
+def export_clip_onnx(output_dir=ONNX_DIR, quantize=True):
+    """
+    Export the CLIP text and image towers to ONNX (fp32), and optionally a dynamic
+    int8 quantized copy of each. Returns (status, paths, message).
+    """
+    try:
+        import clip
+
+        os.makedirs(output_dir, exist_ok=True)
+        model, preprocess = clip.load(CLIP_MODEL_NAME, device="cpu", jit=False)
+        model = model.float().eval()
+
+        text_path, image_path = onnx_paths(output_dir)
+        with torch.no_grad():
+            torch.onnx.export(
+                TextTower(model), (clip.tokenize(["a photo of a cat"]),), text_path,
+                input_names=["tokens"], output_names=["embeddings"],
+                dynamic_axes={"tokens": {0: "batch"}, "embeddings": {0: "batch"}},
+                opset_version=ONNX_OPSET
+            )
+            torch.onnx.export(
+                ImageTower(model), (torch.randn(1, 3, IMAGE_SIZE, IMAGE_SIZE),), image_path,
+                input_names=["pixels"], output_names=["embeddings"],
+                dynamic_axes={"pixels": {0: "batch"}, "embeddings": {0: "batch"}},
+                opset_version=ONNX_OPSET
+            )
+        paths = [text_path, image_path]
+
+        if quantize:
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+
+            for fp32_path, int8_path in zip(onnx_paths(output_dir), onnx_paths(output_dir, quantized=True)):
+                quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+                paths.append(int8_path)
+
+        return True, paths, "Success"
+    except Exception as e:
+        return False, None, f"Error: {e}"
+
+
+class OnnxClipModel:
+    """
+    ONNX Runtime replacement for the PyTorch CLIP model. encode_text and
+    encode_image take and return torch tensors, so image_text_emb can use it
+    exactly like the model returned by clip.load.
+    """
+
+    def __init__(self, output_dir=ONNX_DIR, quantized=False, num_threads=ONNX_NUM_THREADS):
+        import onnxruntime as ort
+
+        text_path, image_path = onnx_paths(output_dir, quantized=quantized)
+        for path in (text_path, image_path):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"ONNX model not found: {path}, run `python clip_onnx.py export` first")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+
+        providers = ["CPUExecutionProvider"]
+        self.text_session = ort.InferenceSession(text_path, options, providers=providers)
+        self.image_session = ort.InferenceSession(image_path, options, providers=providers)
+
+    def encode_text(self, tokens):
+        outputs = self.text_session.run(None, {"tokens": tokens.cpu().numpy().astype(np.int64)})
+        return torch.from_numpy(outputs[0])
+
+    def encode_image(self, pixels):
+        outputs = self.image_session.run(None, {"pixels": pixels.cpu().numpy().astype(np.float32)})
+        return torch.from_numpy(outputs[0])
+
+
+def load_onnx_clip(quantized=False):
+    # (model, preprocess), same shape as clip.load
+    return OnnxClipModel(quantized=quantized), clip_preprocess()
+
+
+def sample_inputs(image_dir=None, num_images=16):
+    import clip
+    from PIL import Image
+
+    texts = [
+        "a person giving a lecture in front of a whiteboard",
+        "a slide with a bar chart",
+        "two people talking in a kitchen",
+        "a car driving on a highway at night",
+        "close up of a circuit board",
+        "a crowd cheering at a football match",
+        "a cat sleeping on a sofa",
+        "code on a computer screen",
+    ]
+
+    images = []
+    if image_dir:
+        names = sorted(name for name in os.listdir(image_dir) if name.lower().endswith((".jpg", ".jpeg", ".png")))
+        images = [Image.open(os.path.join(image_dir, name)).convert("RGB") for name in names[:num_images]]
+    if not images:
+        # Smooth synthetic images; pure noise is far from what CLIP sees in practice
+        rng = np.random.default_rng(0)
+        for _ in range(num_images):
+            coarse = rng.integers(0, 256, size=(8, 8, 3), dtype=np.uint8)
+            images.append(Image.fromarray(coarse).resize((320, 240), Image.BICUBIC))
+
+    preprocess = clip_preprocess()
+    return clip.tokenize(texts), torch.stack([preprocess(image) for image in images])
+
+
+def cosine_agreement(reference, candidate):
+    reference = reference / np.linalg.norm(reference, axis=-1, keepdims=True)
+    candidate = candidate / np.linalg.norm(candidate, axis=-1, keepdims=True)
+    return np.sum(reference * candidate, axis=-1)
+
+
+def check_parity(output_dir=ONNX_DIR, image_dir=None, thresholds=PARITY_THRESHOLDS):
+    """
+    Compare ONNX embeddings with the PyTorch model on the same inputs.
+    Returns (status, report, message); status is False if any variant falls below
+    its cosine threshold.
+    """
+    try:
+        import clip
+
+        model, _ = clip.load(CLIP_MODEL_NAME, device="cpu", jit=False)
+        model = model.float().eval()
+        tokens, pixels = sample_inputs(image_dir)
+
+        with torch.no_grad():
+            reference = {
+                "text": model.encode_text(tokens).numpy(),
+                "image": model.encode_image(pixels).numpy(),
+            }
+
+        report = {}
+        for variant, quantized in (("fp32", False), ("int8", True)):
+            if not all(os.path.exists(path) for path in onnx_paths(output_dir, quantized=quantized)):
+                continue
+            onnx_model = OnnxClipModel(output_dir, quantized=quantized)
+            candidate = {
+                "text": onnx_model.encode_text(tokens).numpy(),
+                "image": onnx_model.encode_image(pixels).numpy(),
+            }
+            for tower in ("text", "image"):
+                agreement = cosine_agreement(reference[tower], candidate[tower])
+                report[f"{variant}_{tower}"] = {
+                    "min_cosine": round(float(agreement.min()), 5),
+                    "mean_cosine": round(float(agreement.mean()), 5),
+                    "threshold": thresholds[variant],
+                    "passed": bool(agreement.min() >= thresholds[variant]),
+                }
+
+        if not report:
+            raise Exception(f"No exported ONNX models found in {output_dir}")
+
+        failed = [name for name, result in report.items() if not result["passed"]]
+        if failed:
+            return False, report, f"Parity check failed for {', '.join(failed)}"
+        return True, report, "Success"
+    except Exception as e:
+        return False, None, f"Error: {e}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export CLIP to ONNX and check parity with PyTorch.")
+    parser.add_argument("command", choices=["export", "parity"])
+    parser.add_argument("--output-dir", default=ONNX_DIR)
+    parser.add_argument("--no-quantize", action="store_true", help="Skip the int8 quantized variant")
+    parser.add_argument("--images", help="Folder of sample images for the parity check")
+    args = parser.parse_args()
+
+    report = None
+    if args.command == "export":
+        status, paths, message = export_clip_onnx(args.output_dir, quantize=not args.no_quantize)
+        print(message)
+        for path in paths or []:
+            print(f"  {path}")
+        if status:
+            status, report, message = check_parity(args.output_dir, args.images)
+    else:
+        status, report, message = check_parity(args.output_dir, args.images)
+
+    for name, result in (report or {}).items():
+        print(f"{name:>12}: min {result['min_cosine']:.5f} mean {result['mean_cosine']:.5f} (threshold {result['threshold']}) {'ok' if result['passed'] else 'FAILED'}")
+    print(message)
+    raise SystemExit(0 if status else 1)
@@ -35,3 +35,21 @@ def download_video(url, output_path='.'):
 
     except Exception as e:
         return False, None
+
+def get_video_details(url):
+    """
+    Channel, title and duration of a video from its page, without downloading it.
+    """
+    try:
+        with yt_dlp.YoutubeDL({'quiet': True, 'skip_download': True}) as ydl:
+            info = ydl.extract_info(url, download=False)
+
+        details = {
+            "channel": info.get("channel") or info.get("uploader") or "",
+            "title": info.get("title") or "",
+            "duration": float(info.get("duration") or 0),
+        }
+        return True, details
+
+    except Exception as e:
+        return False, None
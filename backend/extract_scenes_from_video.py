@@ -1,68 +1,357 @@
 import os
 import cv2
 import csv
-from scenedetect import VideoManager, SceneManager
+import math
+from collections import deque
+from scenedetect import VideoManager, SceneManager, FrameTimecode
 from scenedetect.detectors import ContentDetector
+from scenedetect.scene_manager import compute_downscale_factor
+
+SCENE_THRESHOLD = 30.0
+MIN_SCENE_LEN = 15
+# The fused extractor budgets long scenes window by window (the per-scene limits
+# apply to each window), so frames go out without waiting for the scene's cut
+SCENE_WINDOW_SEC = 120
+
+# Per-scene sampling rate moves from min_fps for static scenes to max_fps for scenes
+# whose mean frame difference reaches motion_scale (0-255 grey levels); base_fps is
+# used when no motion score is available (seek/sequential modes)
+DEFAULT_SAMPLING_POLICY = {
+    "base_fps": 0.5,
+    "min_fps": 0.25,
+    "max_fps": 1.0,
+    "motion_scale": 20.0,
+    "min_frames_per_scene": 1,
+    "max_frames_per_scene": 60,
+    "max_frames_per_video": 2000,
+}
+
+
+def fixed_rate_policy(fps):
+    # Plain fps sampling, the behaviour of the original extractor: every frame on the
+    # sampling grid is kept, no budgets apply
+    return {
+        "fixed_rate": True,
+        "base_fps": fps,
+        "min_fps": fps,
+        "max_fps": fps,
+        "motion_scale": 1.0,
+        "min_frames_per_scene": 1,
+        "max_frames_per_scene": math.inf,
+        "max_frames_per_video": math.inf,
+    }
+
+
+def sampling_step(original_fps, policy):
+    # Candidate frames are taken at the policy's highest rate; never 0 for low-fps sources
+    return max(1, int(original_fps / policy["max_fps"]))
+
+
+def video_fps_cap(policy, total_frames, original_fps):
+    # Rate that spreads max_frames_per_video evenly over the whole video
+    if total_frames <= 0 or original_fps <= 0:
+        return math.inf
+    return policy["max_frames_per_video"] / (total_frames / original_fps)
+
+
+def scene_frame_budget(policy, scene_frames, original_fps, motion=None, fps_cap=math.inf):
+    """
+    Number of frames to keep for a scene of `scene_frames` frames, from its length
+    and (when known) its motion score, within the per-scene limits.
+    """
+    if motion is None:
+        rate = policy["base_fps"]
+    else:
+        rate = policy["min_fps"] + (policy["max_fps"] - policy["min_fps"]) * min(1.0, motion / policy["motion_scale"])
+    rate = min(rate, fps_cap)
+
+    budget = math.ceil(scene_frames / original_fps * rate)
+    return int(max(policy["min_frames_per_scene"], min(budget, policy["max_frames_per_scene"])))
+
+
+def select_evenly(candidates, budget):
+    # Centre of each of `budget` equal slices, so a single frame is the middle of the scene
+    if budget >= len(candidates):
+        return list(candidates)
+    return [candidates[int((i + 0.5) * len(candidates) / budget)] for i in range(budget)]
 
 def detect_scenes(video_path):
     video_manager = VideoManager([video_path])
     scene_manager = SceneManager()
-    scene_manager.add_detector(ContentDetector(threshold=30.0))
+    scene_manager.add_detector(ContentDetector(threshold=SCENE_THRESHOLD, min_scene_len=MIN_SCENE_LEN))
 
     video_manager.set_downscale_factor()
     video_manager.start()
 
     scene_manager.detect_scenes(frame_source=video_manager)
-    scene_list = scene_manager.get_scene_list()
+    # A video without cuts is one scene, same as the fused extractor
+    scene_list = scene_manager.get_scene_list(start_in_scene=True)
     print(f"[INFO] Detected {len(scene_list)} scenes.")
     video_manager.release()
     return scene_list
 
 
-def extract_frames_per_scene(video_path, output_dir, fps=0.5, save_csv=True):
-    try:
-        scene_list = detect_scenes(video_path)
+def scene_frame_ranges(scene_list, original_fps):
+    return [
+        (int(start_time.get_seconds() * original_fps), int(end_time.get_seconds() * original_fps))
+        for start_time, end_time in scene_list
+    ]
 
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
 
-        cap = cv2.VideoCapture(video_path)
-        original_fps = cap.get(cv2.CAP_PROP_FPS)
+def plan_scene_frames(scene_ranges, original_fps, policy, total_frames=0):
+    # Policy-driven plan for modes where scenes are known up front but motion is not
+    step = sampling_step(original_fps, policy)
+    fps_cap = video_fps_cap(policy, total_frames, original_fps)
+    remaining = policy["max_frames_per_video"]
 
-        metadata = []
+    plan = []
+    for i, (scene_start_frame, scene_end_frame) in enumerate(scene_ranges):
+        candidates = list(range(scene_start_frame, scene_end_frame, step))
+        if policy.get("fixed_rate"):
+            selected = candidates
+        else:
+            budget = scene_frame_budget(policy, scene_end_frame - scene_start_frame, original_fps, fps_cap=fps_cap)
+            selected = select_evenly(candidates, min(budget, remaining))
+        remaining -= len(selected)
+        plan.extend((i, frame_count, frame_id) for frame_count, frame_id in enumerate(selected))
+    return plan
 
-        for i, (start_time, end_time) in enumerate(scene_list):
-            scene_start_frame = int(start_time.get_seconds() * original_fps)
-            scene_end_frame = int(end_time.get_seconds() * original_fps)
-            step = int(original_fps / fps)  # ⬅ this is now large for low fps (e.g., 60 if 30fps input and 0.5 fps target)
 
-            cap.set(cv2.CAP_PROP_POS_FRAMES, scene_start_frame)
-            frame_id = scene_start_frame
-            frame_count = 0
+def plan_sample_frames(scene_ranges, step):
+    # (scene, frame_count, frame_id) for every frame to sample, in stream order
+    plan = []
+    for i, (scene_start_frame, scene_end_frame) in enumerate(scene_ranges):
+        for frame_count, frame_id in enumerate(range(scene_start_frame, scene_end_frame, step)):
+            plan.append((i, frame_count, frame_id))
+    return plan
 
-            while frame_id < scene_end_frame:
-                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_id)
-                ret, frame = cap.read()
-                if not ret:
-                    break
 
-                timestamp_sec = frame_id / original_fps
-                out_filename = f'scene_{i:03}_frame_{frame_count:04}.jpg'
-                out_path = os.path.join(output_dir, out_filename)
-                cv2.imwrite(out_path, frame)
+def read_frames_seek(cap, plan):
+    # Seeks before every sampled frame; each seek re-decodes from the previous keyframe
+    failed_scene = None
+    for scene, frame_count, frame_id in plan:
+        if scene == failed_scene:
+            continue
+
+        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_id)
+        ret, frame = cap.read()
+        if not ret:
+            failed_scene = scene
+            continue
+
+        yield scene, frame_count, frame_id, frame
+
+
+def read_frames_sequential(cap, plan):
+    # Walks the stream once: grab() skips unneeded frames, read() decodes only sampled ones
+    position = 0
+    for scene, frame_count, frame_id in plan:
+        if frame_id < position:
+            continue
+
+        while position < frame_id:
+            if not cap.grab():
+                return
+            position += 1
+
+        ret, frame = cap.read()
+        position += 1
+        if not ret:
+            return
+
+        yield scene, frame_count, frame_id, frame
+
+
+def read_frames_fused(cap, fps, scene_list, policy=None):
+    """
+    Run ContentDetector and the frame sampler over a single decode of the stream.
+
+    With a fixed-rate policy (the default) every frame on the sampling grid is
+    yielded as soon as no late cut can move it to a new scene. Otherwise candidate
+    frames are buffered (thinned to at most twice max_frames_per_scene) with their
+    mean frame difference, and the policy picks frames per window of at most
+    SCENE_WINDOW_SEC, so a long scene is budgeted window by window and its frames
+    go out before the scene closes. Yields (scene, frame_count, frame_id, frame)
+    like the other readers and appends (start, end) FrameTimecode pairs to
+    `scene_list` as scenes are detected.
+    """
+    if policy is None:
+        policy = fixed_rate_policy(fps)
+    fixed = policy.get("fixed_rate", False)
+
+    original_fps = cap.get(cv2.CAP_PROP_FPS)
+    fps_cap = video_fps_cap(policy, cap.get(cv2.CAP_PROP_FRAME_COUNT), original_fps)
+    base_step = sampling_step(original_fps, policy)
+    max_candidates = 2 * policy["max_frames_per_scene"]
+    detector = ContentDetector(threshold=SCENE_THRESHOLD, min_scene_len=MIN_SCENE_LEN)
+    downscale = None
+
+    # The detector's flash filter reports a cut up to MIN_SCENE_LEN frames late, so
+    # frames are held back this long and the last ones are kept to seed a new scene
+    lookback = 2 * MIN_SCENE_LEN + 1
+    window_frames = max(lookback, int(SCENE_WINDOW_SEC * original_fps))
+    recent_frames = deque(maxlen=lookback)
+    candidates = []
+    step = base_step
+
+    scene = 0
+    scene_start = 0
+    window_start = 0
+    scene_frame_count = 0
+    frame_num = 0
+    motion_sum = 0.0
+    motion_count = 0
+    previous_gray = None
+    emitted = 0
 
-                metadata.append({
-                    "scene": i,
-                    "frame_count": frame_count,
-                    "frame_id": frame_id,
-                    "timestamp_sec": round(timestamp_sec, 3),
-                    "file_name": out_filename
-                })
+    def flush_window(end):
+        nonlocal candidates, window_start, scene_frame_count, step, motion_sum, motion_count, emitted
+        ready = [c for c in candidates if c[0] < end]
+        if fixed:
+            selected = ready
+        else:
+            motion = motion_sum / motion_count if motion_count else 0.0
+            budget = scene_frame_budget(policy, end - window_start, original_fps, motion=motion, fps_cap=fps_cap)
+            selected = select_evenly(ready, min(budget, policy["max_frames_per_video"] - emitted))
+            step = base_step
+            motion_sum = 0.0
+            motion_count = 0
+        emitted += len(selected)
+        flushed = [(scene, scene_frame_count + k, frame_id, frame) for k, (frame_id, frame) in enumerate(selected)]
 
-                frame_id += step
-                frame_count += 1
+        scene_frame_count += len(selected)
+        window_start = end
+        candidates = [c for c in candidates if c[0] >= end]
+        return flushed
 
+    def close_scene(end):
+        nonlocal scene, scene_start, window_start, scene_frame_count, candidates
+        closed = flush_window(end)
+        scene_list.append((FrameTimecode(scene_start, original_fps), FrameTimecode(end, original_fps)))
+
+        scene += 1
+        scene_start = end
+        window_start = end
+        scene_frame_count = 0
+        # Frames decoded past the cut belong to the new scene and its own sampling grid
+        candidates = [(frame_id, frame) for frame_id, frame in recent_frames if frame_id >= end and (frame_id - end) % step == 0]
+        return closed
+
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+
+        if downscale is None:
+            downscale = compute_downscale_factor(frame.shape[1])
+        detect_frame = frame
+        if downscale > 1:
+            height, width = frame.shape[:2]
+            detect_frame = cv2.resize(frame, (round(width / downscale), round(height / downscale)), interpolation=cv2.INTER_LINEAR)
+
+        if not fixed:
+            gray = cv2.cvtColor(detect_frame, cv2.COLOR_BGR2GRAY)
+            if previous_gray is not None:
+                motion_sum += float(cv2.absdiff(gray, previous_gray).mean())
+                motion_count += 1
+            previous_gray = gray
+
+        for cut in detector.process_frame(frame_num, detect_frame):
+            if cut > scene_start:
+                yield from close_scene(cut)
+
+        if (frame_num - scene_start) % step == 0:
+            candidates.append((frame_num, frame))
+            if len(candidates) > max_candidates:
+                # Keep memory bounded within a window by halving the candidate rate
+                candidates = candidates[::2]
+                step *= 2
+        recent_frames.append((frame_num, frame))
+
+        settled = frame_num - lookback
+        if fixed and settled > window_start:
+            yield from flush_window(settled)
+        elif settled >= window_start + window_frames:
+            yield from flush_window(window_start + window_frames)
+
+        frame_num += 1
+
+    for cut in detector.post_process(frame_num):
+        if cut > scene_start:
+            yield from close_scene(cut)
+    if frame_num > scene_start:
+        yield from close_scene(frame_num)
+
+
+FRAME_READERS = {
+    "seek": read_frames_seek,
+    "sequential": read_frames_sequential,
+}
+
+
+def iter_frames_per_scene(video_path, fps=0.5, mode="fused", output_dir=None, scene_list=None, policy=None):
+    """
+    Yield (metadata, frame) for every sampled frame, frame being a BGR numpy array.
+
+    Frames are sampled at a fixed `fps` unless a sampling `policy` is given (see
+    DEFAULT_SAMPLING_POLICY). Keyframes are only written to disk when `output_dir`
+    is given; detected scenes are appended to `scene_list` when one is passed in.
+    """
+    if mode != "fused" and mode not in FRAME_READERS:
+        raise Exception(f"Unrecognized frame extraction mode: {mode}")
+
+    if scene_list is None:
+        scene_list = []
+
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    cap = cv2.VideoCapture(video_path)
+    try:
+        original_fps = cap.get(cv2.CAP_PROP_FPS)
+
+        if mode == "fused":
+            # Scene detection and sampling share one decode of the video
+            frames = read_frames_fused(cap, fps, scene_list, policy=policy)
+        else:
+            scene_list.extend(detect_scenes(video_path))
+            plan = plan_scene_frames(
+                scene_frame_ranges(scene_list, original_fps),
+                original_fps,
+                policy if policy is not None else fixed_rate_policy(fps),
+                total_frames=cap.get(cv2.CAP_PROP_FRAME_COUNT)
+            )
+            frames = FRAME_READERS[mode](cap, plan)
+
+        for i, frame_count, frame_id, frame in frames:
+            timestamp_sec = frame_id / original_fps
+            frame_metadata = {
+                "scene": i,
+                "frame_count": frame_count,
+                "frame_id": frame_id,
+                "timestamp_sec": round(timestamp_sec, 3),
+            }
+
+            if output_dir:
+                out_filename = f'scene_{i:03}_frame_{frame_count:04}.jpg'
+                cv2.imwrite(os.path.join(output_dir, out_filename), frame)
+                frame_metadata["file_name"] = out_filename
+
+            yield frame_metadata, frame
+
+        if mode == "fused":
+            print(f"[INFO] Detected {len(scene_list)} scenes.")
+    finally:
         cap.release()
+
+
+def extract_frames_per_scene(video_path, output_dir, fps=0.5, save_csv=True, mode="fused", policy=None):
+    try:
+        metadata = [
+            frame_metadata
+            for frame_metadata, _ in iter_frames_per_scene(video_path, fps=fps, mode=mode, output_dir=output_dir, policy=policy)
+        ]
+        csv_path = None
         print(f"[INFO] Frames saved in {output_dir}")
 
         if save_csv and metadata:
@@ -80,4 +369,3 @@ def extract_frames_per_scene(video_path, output_dir, fps=0.5, save_csv=True):
         return False, None, None, f"Error: {e}"
 
         
-
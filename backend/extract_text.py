@@ -1,32 +1,203 @@
-from faster_whisper import WhisperModel
+import os
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
-model_size = "distil-large-v3"
-# model_size = "small"
+import numpy as np
 
-audio_model = WhisperModel(model_size, device="cpu", compute_type="int8")
+import model_registry
+from model_registry import get_whisper_model
+from metrics import ingest_phase_seconds, ingest_items_total
 
-def extract_text(audio_file_path):
+SAMPLE_RATE = 16000
+
+# "batched" uses faster-whisper's VAD-chunked batched pipeline, "process" transcribes
+# silence-bounded chunks in a process pool, "sequential" is a single transcribe call
+TRANSCRIBE_MODE = os.environ.get("TRANSCRIBE_MODE", "batched")
+TRANSCRIBE_BATCH_SIZE = int(os.environ.get("TRANSCRIBE_BATCH_SIZE", "8"))
+TRANSCRIBE_WORKERS = int(os.environ.get("TRANSCRIBE_WORKERS", str(max(1, (os.cpu_count() or 1) // 4))))
+# Upper bound on the audio handed to one worker in "process" mode
+MAX_CHUNK_SEC = 120
+MIN_SILENCE_MS = 500
+# Streamed audio is transcribed in windows of about this length, cut at a silence
+STREAM_WINDOW_SEC = 240
+
+TRANSCRIBE_OPTIONS = {
+    "beam_size": 1,             # Greedy decoding for maximum speed
+    "language": "en",           # Force English language
+    "word_timestamps": False,   # Skip word-level timestamps (faster)
+    "temperature": 0,
+    "suppress_tokens": None,
+}
+
+
+def split_audio_on_silence(audio, max_chunk_sec=MAX_CHUNK_SEC):
+    """
+    Split decoded 16 kHz audio into (start_sample, end_sample) chunks of at most
+    `max_chunk_sec`, cutting only in silences found by the VAD.
+    """
+    from faster_whisper.vad import VadOptions, get_speech_timestamps
+
+    vad_options = VadOptions(min_silence_duration_ms=MIN_SILENCE_MS, max_speech_duration_s=max_chunk_sec)
+    max_chunk_samples = int(max_chunk_sec * SAMPLE_RATE)
+
+    chunks = []
+    for speech in get_speech_timestamps(audio, vad_options, sampling_rate=SAMPLE_RATE):
+        if chunks and speech["end"] - chunks[-1][0] <= max_chunk_samples:
+            chunks[-1][1] = speech["end"]
+        else:
+            chunks.append([speech["start"], speech["end"]])
+    return [tuple(chunk) for chunk in chunks]
+
+
+def init_transcribe_worker(cpu_threads):
+    # Split the cores between workers instead of letting each one grab all of them
+    model_registry.WHISPER_CPU_THREADS = cpu_threads
+
+
+def transcribe_chunk(chunk_audio, offset_sec):
+    segments, info = get_whisper_model().transcribe(chunk_audio, vad_filter=False, **TRANSCRIBE_OPTIONS)
+    return [
+        {
+            "start": round(segment.start + offset_sec, 3),
+            "end": round(segment.end + offset_sec, 3),
+            "text": segment.text.strip()
+        }
+        for segment in segments
+    ]
+
+
+transcribe_pool = None
+transcribe_pool_lock = threading.Lock()
+
+
+def get_transcribe_pool():
+    # Kept alive between calls so each worker loads Whisper only once
+    global transcribe_pool
+    with transcribe_pool_lock:
+        if transcribe_pool is None:
+            cpu_threads = max(1, (os.cpu_count() or 1) // TRANSCRIBE_WORKERS)
+            transcribe_pool = ProcessPoolExecutor(
+                max_workers=TRANSCRIBE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_transcribe_worker,
+                initargs=(cpu_threads,)
+            )
+        return transcribe_pool
+
+
+def transcribe_in_processes(audio):
+    chunks = split_audio_on_silence(audio)
+    if not chunks:
+        return []
+
+    pool = get_transcribe_pool()
+    futures = [
+        pool.submit(transcribe_chunk, audio[start:end], start / SAMPLE_RATE)
+        for start, end in chunks
+    ]
+    # Chunks are in timeline order, so stitching is a concatenation
+    return [entry for future in futures for entry in future.result()]
+
+
+def extract_text(audio_file_path, mode=TRANSCRIBE_MODE, batch_size=TRANSCRIBE_BATCH_SIZE):
     try:
-        segments, info = audio_model.transcribe(
-            audio_file_path,
-            beam_size=1,         # Greedy decoding for maximum speed
-            language="en",       # Force English language
-            word_timestamps=False, # Skip word-level timestamps (faster)
-            temperature=0,
-            suppress_tokens=None,
-        )
+        start = time.perf_counter()
+        if mode == "sequential":
+            segments, info = get_whisper_model().transcribe(audio_file_path, **TRANSCRIBE_OPTIONS)
+        elif mode == "batched":
+            from faster_whisper import BatchedInferencePipeline
 
+            pipeline = BatchedInferencePipeline(model=get_whisper_model())
+            # The batched pipeline defaults to one segment per ~30 s VAD chunk; keep
+            # Whisper's segment timestamps like the other modes
+            segments, info = pipeline.transcribe(audio_file_path, batch_size=batch_size, without_timestamps=False, **TRANSCRIBE_OPTIONS)
+        elif mode == "process":
+            from faster_whisper import decode_audio
+
+            audio = audio_file_path
+            if not isinstance(audio, np.ndarray):
+                audio = decode_audio(audio_file_path, sampling_rate=SAMPLE_RATE)
+            segments = None
+            transcript_segments = transcribe_in_processes(audio)
+        else:
+            raise Exception(f"Unrecognized transcription mode: {mode}")
+
+        if segments is not None:
+            transcript_segments = []
+            for segment in segments:
+                entry = {
+                    "start": segment.start,
+                    "end": segment.end,
+                    "text": segment.text.strip()
+                }
+                transcript_segments.append(entry)
+
+        full_text = " ".join(segment["text"] for segment in transcript_segments)
+        # Segments are generated lazily, so this includes the decoding
+        ingest_phase_seconds.observe(time.perf_counter() - start, phase="transcription")
+        ingest_items_total.inc(len(transcript_segments), phase="transcription")
+
+        return True, transcript_segments, full_text, "Success"
+    except Exception as e:
+        return False, None, None, f"Error: {e}"
+
+
+def find_silence_cut(audio):
+    """
+    Sample index of the last silence in `audio`, so the speech after it is left for
+    the next window. Falls back to the end of the buffer when there is no such gap.
+    """
+    from faster_whisper.vad import VadOptions, get_speech_timestamps
+
+    speech = get_speech_timestamps(audio, VadOptions(min_silence_duration_ms=MIN_SILENCE_MS), sampling_rate=SAMPLE_RATE)
+    if len(speech) < 2:
+        return len(audio)
+    return (speech[-2]["end"] + speech[-1]["start"]) // 2
+
+
+def extract_text_from_stream(pcm_chunks, mode=TRANSCRIBE_MODE, batch_size=TRANSCRIBE_BATCH_SIZE, window_sec=STREAM_WINDOW_SEC):
+    """
+    Transcribe 16 kHz float32 audio chunks (e.g. from audio_processing.iter_audio_pcm)
+    window by window, so transcription starts while the audio is still being decoded.
+    Returns the same tuple as extract_text with absolute timestamps.
+    """
+    try:
+        window_samples = int(window_sec * SAMPLE_RATE)
         transcript_segments = []
-        for segment in segments:
-            entry = {
-                "start": segment.start,
-                "end": segment.end,
-                "text": segment.text.strip()
-            }
-            transcript_segments.append(entry)
+        pending = []
+        pending_samples = 0
+        offset_samples = 0
+
+        def transcribe_window(audio, offset_sec):
+            status, segments, full_text, message = extract_text(audio, mode=mode, batch_size=batch_size)
+            if not status:
+                raise Exception(message)
+            for segment in segments:
+                segment["start"] = round(segment["start"] + offset_sec, 3)
+                segment["end"] = round(segment["end"] + offset_sec, 3)
+            return segments
+
+        for chunk in pcm_chunks:
+            pending.append(chunk)
+            pending_samples += len(chunk)
+            if pending_samples < window_samples:
+                continue
+
+            audio = np.concatenate(pending)
+            cut = find_silence_cut(audio)
+            transcript_segments += transcribe_window(audio[:cut], offset_samples / SAMPLE_RATE)
+
+            pending = [audio[cut:]]
+            pending_samples = len(audio) - cut
+            offset_samples += cut
+
+        if pending_samples:
+            transcript_segments += transcribe_window(np.concatenate(pending), offset_samples / SAMPLE_RATE)
 
         full_text = " ".join(segment["text"] for segment in transcript_segments)
 
         return True, transcript_segments, full_text, "Success"
     except Exception as e:
-        return False, None, None, f"Error: {e}"
\ No newline at end of file
+        return False, None, None, f"Error: {e}"
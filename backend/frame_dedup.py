@@ -0,0 +1,48 @@
+import cv2
+import numpy as np
+
+# Difference hash of HASH_SIZE x HASH_SIZE bits
+HASH_SIZE = 8
+# Frames whose hash differs from the last kept frame in at most this many bits are dropped
+DEDUP_MAX_DISTANCE = 6
+
+
+def frame_hash(frame):
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA)
+    return (small[:, 1:] > small[:, :-1]).flatten()
+
+
+def dedup_frames(frame_stream, max_distance=DEDUP_MAX_DISTANCE):
+    """
+    Drop near-duplicate frames from a (metadata, frame) stream before CLIP encoding.
+
+    Each frame is compared with the last kept frame of the same scene; duplicates are
+    dropped and the kept frame's "end_sec" is extended to cover them, so its metadata
+    records the whole time range it stands for.
+    """
+    kept = None
+    total = 0
+    dropped = 0
+
+    for frame_metadata, frame in frame_stream:
+        total += 1
+        tmp_hash = frame_hash(frame)
+
+        if kept is not None and kept[0]["scene"] == frame_metadata["scene"]:
+            if np.count_nonzero(kept[2] != tmp_hash) <= max_distance:
+                kept[0]["end_sec"] = frame_metadata["timestamp_sec"]
+                dropped += 1
+                continue
+
+        # The previous frame's range is final once a different frame shows up
+        if kept is not None:
+            yield kept[0], kept[1]
+
+        frame_metadata["end_sec"] = frame_metadata["timestamp_sec"]
+        kept = (frame_metadata, frame, tmp_hash)
+
+    if kept is not None:
+        yield kept[0], kept[1]
+
+    print(f"[INFO] Dropped {dropped} of {total} near-duplicate frames.")
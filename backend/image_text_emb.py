@@ -1,16 +1,42 @@
+import os
 import clip
 import torch
 from PIL import Image
 import numpy as np
 from tqdm import tqdm
+from itertools import islice
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from model_registry import get_clip_model
+from metrics import timed_phase, ingest_phase_seconds, ingest_items_total
 
 device = "cuda" if torch.cuda.is_available() else "cpu"
 
-model, preprocess = clip.load("ViT-B/32", device=device)
+IMAGE_BATCH_SIZE = int(os.environ.get("IMAGE_BATCH_SIZE", "32"))
+# Threads decoding and preprocessing images while the model encodes the previous batch
+IMAGE_LOADER_WORKERS = int(os.environ.get("IMAGE_LOADER_WORKERS", "4"))
+# Batches prepared ahead of the one being encoded
+IMAGE_PREFETCH_BATCHES = int(os.environ.get("IMAGE_PREFETCH_BATCHES", "2"))
+# Intra-op threads for CLIP on CPU; 0 keeps torch's default
+TORCH_NUM_THREADS = int(os.environ.get("TORCH_NUM_THREADS", "0"))
+
+if TORCH_NUM_THREADS > 0:
+    torch.set_num_threads(TORCH_NUM_THREADS)
+
+# Transcript segments encoded per forward pass
+TEXT_BATCH_SIZE = int(os.environ.get("TEXT_BATCH_SIZE", "256"))
+# What to do with text longer than CLIP's context: "split" into pieces that are
+# embedded separately and averaged, or "truncate" to the first tokens
+TEXT_OVERFLOW = os.environ.get("TEXT_OVERFLOW", "split")
+# 77 positions minus the start and end tokens
+CLIP_TEXT_TOKENS = 75
+
 
 def get_text_embbeding(texts):
     try:
-        text_tokens = clip.tokenize(texts).to(device)
+        model, preprocess = get_clip_model()
+        text_tokens = clip.tokenize(texts, truncate=True).to(device)
         with torch.no_grad():
             text_embeddings = model.encode_text(text_tokens)
             text_embeddings = text_embeddings / text_embeddings.norm(dim=-1, keepdim=True)
@@ -20,17 +46,177 @@ def get_text_embbeding(texts):
         return False, None, f"Error: {e}"
 
 
-def get_image_embeddings_batch(image_paths, batch_size=32):
+def get_image_embbeding(image_paths):
+    """
+    Encode a few images (e.g. one batch of search queries) in one forward pass,
+    without the loader pool and progress bar of the ingest path.
+    """
+    try:
+        model, preprocess = get_clip_model()
+        image_tensor = torch.stack([preprocess(Image.open(image_path).convert("RGB")) for image_path in image_paths])
+        with torch.no_grad():
+            image_embeddings = model.encode_image(image_tensor.to(device)).cpu().numpy()
+
+        return True, image_embeddings, "Success"
+    except Exception as e:
+        return False, None, f"Error: {e}"
+
+
+def split_text_to_fit(text, max_tokens=CLIP_TEXT_TOKENS):
+    """
+    Split `text` at word boundaries into pieces of at most `max_tokens` CLIP tokens.
+    A single word longer than that becomes its own piece and is truncated later.
+    """
+    from clip.clip import _tokenizer
+
+    pieces = []
+    words = []
+    used = 0
+    for word in text.split():
+        count = len(_tokenizer.encode(word))
+        if words and used + count > max_tokens:
+            pieces.append(" ".join(words))
+            words = []
+            used = 0
+        words.append(word)
+        used += count
+    if words or not pieces:
+        pieces.append(" ".join(words))
+    return pieces
+
+
+def get_text_embeddings_batched(texts, batch_size=TEXT_BATCH_SIZE, overflow=TEXT_OVERFLOW):
+    """
+    Embed any number of texts in batches of `batch_size`, never failing on text
+    longer than CLIP's context.
+
+    Returns (status, embeddings, split_parts, message): embeddings is a normalized
+    (len(texts), dim) float32 array and split_parts[i] the number of pieces text i
+    was embedded from (1 unless it was split).
+    """
+    try:
+        if overflow not in ("split", "truncate"):
+            raise Exception(f"Unrecognized text overflow mode: {overflow}")
+
+        model, preprocess = get_clip_model()
+
+        pieces = []
+        owners = []
+        split_parts = []
+        for index, text in enumerate(texts):
+            text_pieces = split_text_to_fit(text) if overflow == "split" else [text]
+            pieces.extend(text_pieces)
+            owners.extend([index] * len(text_pieces))
+            split_parts.append(len(text_pieces))
+
+        embeddings = None
+        for start in range(0, len(pieces), batch_size):
+            text_tokens = clip.tokenize(pieces[start:start + batch_size], truncate=True).to(device)
+            with torch.no_grad(), timed_phase(ingest_phase_seconds, "text_embedding"):
+                batch_features = model.encode_text(text_tokens).float()
+                batch_features = (batch_features / batch_features.norm(dim=-1, keepdim=True)).cpu().numpy()
+            ingest_items_total.inc(len(text_tokens), phase="text_embedding")
+
+            if embeddings is None:
+                embeddings = np.zeros((len(texts), batch_features.shape[1]), dtype=np.float32)
+            # Pieces of a split text are averaged into one vector
+            np.add.at(embeddings, owners[start:start + batch_size], batch_features)
+
+        if embeddings is None:
+            return True, np.zeros((0, 0), dtype=np.float32), split_parts, "Success"
+
+        embeddings /= np.linalg.norm(embeddings, axis=-1, keepdims=True)
+
+        num_split = sum(1 for parts in split_parts if parts > 1)
+        if num_split:
+            print(f"[INFO] Split {num_split} of {len(texts)} texts longer than {CLIP_TEXT_TOKENS} tokens")
+
+        return True, embeddings, split_parts, "Success"
+    except Exception as e:
+        return False, None, None, f"Error: {e}"
+
+
+def iter_preprocessed_batches(items, load, batch_size=IMAGE_BATCH_SIZE, num_workers=IMAGE_LOADER_WORKERS, prefetch=IMAGE_PREFETCH_BATCHES):
+    """
+    Yield (batch_items, batch_tensor) for an iterable of items, running `load(item)`
+    (decode + preprocess) in a thread pool up to `prefetch` batches ahead of the
+    consumer, so loading overlaps with encoding.
+    """
+    items = iter(items)
+    pool = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="image-loader")
+    in_flight = deque()
+
+    def submit_next():
+        batch_items = list(islice(items, batch_size))
+        if batch_items:
+            in_flight.append((batch_items, [pool.submit(load, item) for item in batch_items]))
+        return bool(batch_items)
+
+    try:
+        for _ in range(prefetch + 1):
+            if not submit_next():
+                break
+
+        while in_flight:
+            batch_items, futures = in_flight.popleft()
+            batch_tensor = torch.stack([future.result() for future in futures])
+            submit_next()
+            yield batch_items, batch_tensor
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_image_embeddings(image_paths, batch_size=IMAGE_BATCH_SIZE, num_workers=IMAGE_LOADER_WORKERS, prefetch=IMAGE_PREFETCH_BATCHES):
+    """
+    Yield one embeddings array per batch of image paths, keeping memory bounded.
+    """
+    model, preprocess = get_clip_model()
+
+    def load(image_path):
+        return preprocess(Image.open(image_path).convert("RGB"))
+
+    for batch_paths, batch_tensor in iter_preprocessed_batches(image_paths, load, batch_size, num_workers, prefetch):
+        with torch.no_grad(), timed_phase(ingest_phase_seconds, "image_embedding"):
+            batch_features = model.encode_image(batch_tensor.to(device)).cpu().numpy()
+        ingest_items_total.inc(len(batch_paths), phase="image_embedding")
+        yield batch_features
+
+
+def get_image_embeddings_batch(image_paths, batch_size=IMAGE_BATCH_SIZE):
     try:
         all_embeddings = []
-        for i in tqdm(range(0, len(image_paths), batch_size), desc="Extracting CLIP embeddings"):
-            batch_paths = image_paths[i:i+batch_size]
-            batch_images = [preprocess(Image.open(p).convert("RGB")) for p in batch_paths]
-            batch_tensor = torch.stack(batch_images).to(device)
-            with torch.no_grad():
-                batch_features = model.encode_image(batch_tensor).cpu().numpy()
+        total_batches = (len(image_paths) + batch_size - 1) // batch_size
+        for batch_features in tqdm(iter_image_embeddings(image_paths, batch_size=batch_size), total=total_batches, desc="Extracting CLIP embeddings"):
             all_embeddings.extend(batch_features)
 
         return True, all_embeddings, "Success"
     except Exception as e:
         return False, None, f"Error: {e}"
+
+
+def get_frame_embeddings_batch(frame_stream, batch_size=IMAGE_BATCH_SIZE, num_workers=IMAGE_LOADER_WORKERS, prefetch=IMAGE_PREFETCH_BATCHES):
+    """
+    Encode an iterable of (metadata, BGR frame array) pairs in batches.
+
+    Yields (metadata_list, embeddings) per batch so encoding can start while the
+    frames are still being extracted.
+    """
+    model, preprocess = get_clip_model()
+
+    def load(item):
+        frame_metadata, frame = item
+        return preprocess(Image.fromarray(np.ascontiguousarray(frame[:, :, ::-1])))
+
+    batches = iter_preprocessed_batches(frame_stream, load, batch_size, num_workers, prefetch)
+    while True:
+        # Time blocked on the extractor: decoding, scene detection and preprocessing
+        with timed_phase(ingest_phase_seconds, "frame_extraction"):
+            next_batch = next(batches, None)
+        if next_batch is None:
+            break
+        batch_items, batch_tensor = next_batch
+
+        with torch.no_grad(), timed_phase(ingest_phase_seconds, "image_embedding"):
+            batch_features = model.encode_image(batch_tensor.to(device)).cpu().numpy()
+        ingest_items_total.inc(len(batch_items), phase="image_embedding")
+        yield [frame_metadata for frame_metadata, _ in batch_items], batch_features
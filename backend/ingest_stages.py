@@ -0,0 +1,56 @@
+import os
+
+from download_video import download_video
+from audio_processing import extract_audio, get_video_info, iter_audio_pcm
+from extract_text import extract_text, extract_text_from_stream
+from extract_scenes_from_video import iter_frames_per_scene
+from image_text_emb import get_frame_embeddings_batch
+from frame_dedup import dedup_frames
+
+# Compute-only pipeline stages. They never touch the vector store, so they can run
+# in worker processes; each one raises on failure as expected by pipeline.run_stages.
+
+def download_stage(video_url, temp_dir):
+    video_download_status, video_file_path = download_video(video_url, output_path=temp_dir)
+    if not video_download_status:
+        raise Exception("Video is not downloaded.")
+    return video_file_path
+
+def probe_stage(video_file_path):
+    # One ffprobe per video; the result is shared by the downstream stages
+    video_info = get_video_info(video_file_path)
+    if video_info is None:
+        print(f"[WARN] Could not probe {video_file_path}")
+        return {}
+    return video_info
+
+def extract_audio_stage(temp_dir, video_file_path):
+    output_audio_path = os.path.join(temp_dir, "output_audio.wav")
+    audio_convert_status, audio_file_path = extract_audio(video_file_path, output_audio_path=output_audio_path)
+    if not audio_convert_status:
+        raise Exception("Audio extraction failed.")
+    return audio_file_path
+
+def transcribe_stage(audio_file_path):
+    extract_text_status, text_segments, full_text, message = extract_text(audio_file_path)
+    if not extract_text_status:
+        raise Exception(f"Text extraction failed: {message}")
+    return text_segments
+
+def stream_transcribe_stage(video_file_path, video_info):
+    # ffmpeg writes raw PCM to a pipe that feeds Whisper directly, no temp WAV
+    if video_info and not video_info.get("audio_codec"):
+        print("[INFO] Video has no audio stream, skipping transcription")
+        return []
+
+    extract_text_status, text_segments, full_text, message = extract_text_from_stream(iter_audio_pcm(video_file_path))
+    if not extract_text_status:
+        raise Exception(f"Text extraction failed: {message}")
+    return text_segments
+
+def embed_frames_stage(keyframes_dir, frame_dedup, sampling_policy, video_file_path):
+    # Materializes the batches so they can be sent back from a worker process
+    frame_stream = iter_frames_per_scene(video_file_path, output_dir=keyframes_dir, policy=sampling_policy)
+    if frame_dedup:
+        frame_stream = dedup_frames(frame_stream)
+    return list(get_frame_embeddings_batch(frame_stream))
@@ -0,0 +1,111 @@
+import os
+import copy
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from video_fusion_search import video_audio_fusion_search
+
+# Number of videos ingested at the same time; each job runs its own stage DAG
+EMBED_WORKERS = int(os.environ.get("EMBED_WORKERS", "2"))
+# Queued + running jobs accepted before /embed starts rejecting submissions
+MAX_PENDING_JOBS = int(os.environ.get("MAX_PENDING_JOBS", "32"))
+# Finished jobs kept around for status polling
+JOB_HISTORY_LIMIT = 1000
+
+executor = ThreadPoolExecutor(max_workers=EMBED_WORKERS, thread_name_prefix="embed-job")
+
+jobs = OrderedDict()
+active_jobs_by_url = {}
+jobs_lock = threading.Lock()
+
+
+def submit_embed_job(video_url):
+    """
+    Queue an ingest job for `video_url` and return (status, job, message).
+
+    A URL that already has a queued or running job is coalesced onto that job.
+    """
+    with jobs_lock:
+        active_job_id = active_jobs_by_url.get(video_url)
+        if active_job_id is not None:
+            return True, copy.deepcopy(jobs[active_job_id]), "Already in progress"
+
+        if len(active_jobs_by_url) >= MAX_PENDING_JOBS:
+            return False, None, f"Too many pending jobs ({MAX_PENDING_JOBS}), retry later"
+
+        job_id = uuid.uuid4().hex
+        jobs[job_id] = {
+            "job_id": job_id,
+            "video_url": video_url,
+            "status": "queued",
+            "message": "",
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "elapsed": None,
+            "progress": 0.0,
+            "stages": {},
+        }
+        active_jobs_by_url[video_url] = job_id
+        prune_finished_jobs()
+        job = copy.deepcopy(jobs[job_id])
+
+    executor.submit(run_embed_job, job_id)
+    return True, job, "Queued"
+
+
+def get_job(job_id):
+    with jobs_lock:
+        job = jobs.get(job_id)
+        return copy.deepcopy(job) if job is not None else None
+
+
+def prune_finished_jobs():
+    # Caller holds jobs_lock
+    finished = [job_id for job_id, job in jobs.items() if job["status"] in ("success", "failed")]
+    for job_id in finished[:max(0, len(jobs) - JOB_HISTORY_LIMIT)]:
+        del jobs[job_id]
+
+
+def on_stage_event(job_id, name, event, info):
+    with jobs_lock:
+        job = jobs[job_id]
+        stage = job["stages"].setdefault(name, {"status": "pending", "started_at": None, "elapsed": None, "message": ""})
+        if event == "started":
+            stage["status"] = "running"
+            stage["started_at"] = time.time()
+        else:
+            stage["status"] = event
+            stage["elapsed"] = info.get("elapsed", stage["elapsed"])
+            stage["message"] = info.get("message", stage["message"])
+
+        finished = sum(1 for tmp in job["stages"].values() if tmp["status"] in ("success", "failed", "skipped"))
+        job["progress"] = round(finished / len(job["stages"]), 3)
+
+
+def run_embed_job(job_id):
+    with jobs_lock:
+        job = jobs[job_id]
+        job["status"] = "running"
+        job["started_at"] = time.time()
+        video_url = job["video_url"]
+
+    try:
+        status, msg = video_audio_fusion_search(
+            video_url,
+            on_event=lambda name, event, info: on_stage_event(job_id, name, event, info)
+        )
+    except Exception as e:
+        status, msg = False, f"Error: {e}"
+
+    with jobs_lock:
+        job = jobs[job_id]
+        job["status"] = "success" if status else "failed"
+        job["message"] = msg
+        job["finished_at"] = time.time()
+        job["elapsed"] = round(job["finished_at"] - job["started_at"], 3)
+        job["progress"] = 1.0
+        active_jobs_by_url.pop(video_url, None)
@@ -1,36 +1,182 @@
 from fastapi import FastAPI, HTTPException, UploadFile, Form, File
-from typing import Optional, Literal
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from typing import Optional, Literal, List
 import uvicorn
 import os
 import uuid
+import time
 import shutil
 import tempfile
+import threading
 import requests
+import json
+from datetime import datetime
+from PIL import Image
 
-from video_fusion_search import video_audio_fusion_search, convert_seconds_to_time_str
-from search_functions import multimodel_search
+from video_fusion_search import convert_seconds_to_time_str
+from search_functions import multimodel_search, global_search, batch_search, GLOBAL_CANDIDATE_MULTIPLIER, GLOBAL_MAX_HITS_PER_VIDEO, BATCH_SEARCH_CHUNK
+from jobs import submit_embed_job, get_job
+from chromadb_functions import delete_video_emb_from_db
+from search_cache import invalidate_video, cache_stats
+from stage_cache import clear_video, stage_cache_stats
+from metrics import render_metrics, timed_phase, search_phase_seconds
+from video_index import delete_video_index, video_index_stats
+from result_merging import merge_hits, MERGE_GAP_SEC, MERGE_OVERFETCH
+from query_encoder import query_encoder_stats
+from model_registry import can_ingest, warm_up, registry_status, SERVICE_ROLE
+
+# Load the role's models in the background at startup instead of on the first request
+WARM_UP_ON_STARTUP = os.environ.get("WARM_UP_ON_STARTUP", "1") == "1"
 
 app = FastAPI()
 
+
+@app.on_event("startup")
+def start_warm_up():
+    if WARM_UP_ON_STARTUP:
+        threading.Thread(target=run_warm_up, name="warm-up", daemon=True).start()
+
+
+def run_warm_up():
+    status, msg = warm_up()
+    if not status:
+        print(f"[ERROR] Warm-up failed: {msg}")
+
+
+@app.get("/ready")
+def readiness():
+    model_status = registry_status()
+    if not model_status["ready"]:
+        raise HTTPException(status_code=503, detail=model_status)
+    return model_status
+
+
 @app.post("/embed")
 def embed_video(url: str = Form(...)):
-    status, msg = video_audio_fusion_search(url)
+    if not can_ingest():
+        raise HTTPException(status_code=503, detail=f"Ingestion is disabled in the {SERVICE_ROLE} role.")
+    status, job, msg = submit_embed_job(url)
+    if not status:
+        raise HTTPException(status_code=503, detail=msg)
+    return {"status": "success", "job_id": job["job_id"], "job": job, "message": msg}
+
+
+@app.get("/jobs/{job_id}")
+def get_embed_job(job_id: str):
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+
+@app.post("/delete")
+def delete_video(url: str = Form(...)):
+    status, msg = delete_video_emb_from_db(url)
+    invalidate_video(url)
+    clear_video(url)
+    delete_video_index(url)
     if not status:
         raise HTTPException(status_code=500, detail=msg)
     return {"status": "success", "message": msg}
 
 
+@app.get("/cache/stats")
+def get_cache_stats():
+    stats = cache_stats()
+    stats["stage_cache"] = stage_cache_stats()
+    stats["video_index"] = video_index_stats()
+    return stats
+
+
+@app.get("/encoder/stats")
+def get_encoder_stats():
+    return query_encoder_stats()
+
+
+@app.get("/metrics")
+def get_metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+def save_query_image(image_file, image_url):
+    tmp_dir = tempfile.gettempdir()
+    tmp_filename = f"tmp_{uuid.uuid4().hex}.jpg"
+    image_path = os.path.join(tmp_dir, tmp_filename)
+
+    if image_file:
+        with open(image_path, "wb") as buffer:
+            shutil.copyfileobj(image_file.file, buffer)
+
+    elif image_url:
+        response = requests.get(image_url, stream=True)
+        if response.status_code == 200:
+            with open(image_path, "wb") as out_file:
+                shutil.copyfileobj(response.raw, out_file)
+        else:
+            raise HTTPException(status_code=400, detail="Image download failed.")
+    else:
+        raise HTTPException(status_code=400, detail="Provide either image_file or image_url for image search.")
+
+    return image_path
+
+
+def parse_date(value):
+    # ISO date or datetime to epoch seconds, for the ingest date filters
+    if not value:
+        return None
+    try:
+        return int(datetime.fromisoformat(value).timestamp())
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid date: {value}")
+
+
+def format_search_result(query_result, n_results, merge, merge_gap_sec):
+    timestamps = []
+    hits = []
+    # "results" and "hits" keep their meaning: the top n_results raw hits
+    for index, tmp in enumerate(query_result["metadatas"][0][:n_results]):
+        start_time = tmp["start"]
+        tmp_timestamp = convert_seconds_to_time_str(start_time)
+        timestamps.append(tmp_timestamp)
+
+        tmp_hit = {"timestamp": tmp_timestamp, "obj": tmp["obj"], "distance": query_result["distances"][0][index]}
+        if "sources" in query_result:
+            tmp_hit["score"] = query_result["scores"][0][index]
+            tmp_hit["sources"] = sorted({source["obj"] for source in query_result["sources"][0][index]})
+        hits.append(tmp_hit)
+
+    response = {"status": "success", "results": timestamps, "hits": hits}
+    if merge:
+        ranges = merge_hits(query_result, n_results, gap_sec=merge_gap_sec)
+        for tmp_range in ranges:
+            tmp_range["start_timestamp"] = convert_seconds_to_time_str(tmp_range["start"])
+            tmp_range["end_timestamp"] = convert_seconds_to_time_str(tmp_range["end"])
+        response["ranges"] = ranges
+    return response
+
+
 @app.post("/search")
 def search_video(
     video_url: str = Form(...),
     n_results: int = Form(5),
     search_query_type: Literal["text", "image"] = Form(...),
     output_from: Literal["text", "image", "both"] = Form(...),
+    fusion: Literal["rrf", "score"] = Form("rrf"),
+    merge: bool = Form(True),
+    merge_gap_sec: float = Form(MERGE_GAP_SEC),
+    timing: bool = Form(False),
     query: Optional[str] = Form(None),
     image_url: Optional[str] = Form(None),
     image_file: Optional[UploadFile] = File(None)
 ):
     image_path = None
+    # Per-phase time in ms, returned when `timing` is set
+    timings = {}
+    request_start = time.perf_counter()
+    # Merging needs more candidates than ranges it returns
+    n_candidates = n_results * MERGE_OVERFETCH if merge else n_results
 
     try:
         # --------- Text Query ---------
@@ -41,38 +187,26 @@ def search_video(
             status, query_result, msg = multimodel_search(
                 query=query,
                 video_url=video_url,
-                n_results=n_results,
+                n_results=n_candidates,
                 search_query_type="text",
-                output_from=output_from
+                output_from=output_from,
+                fusion=fusion,
+                timings=timings
             )
 
         # --------- Image Query ---------
         elif search_query_type == "image":
-            tmp_dir = tempfile.gettempdir()
-            tmp_filename = f"tmp_{uuid.uuid4().hex}.jpg"
-            image_path = os.path.join(tmp_dir, tmp_filename)
-
-            if image_file:
-                with open(image_path, "wb") as buffer:
-                    shutil.copyfileobj(image_file.file, buffer)
-
-            elif image_url:
-                response = requests.get(image_url, stream=True)
-                if response.status_code == 200:
-                    with open(image_path, "wb") as out_file:
-                        shutil.copyfileobj(response.raw, out_file)
-                else:
-                    raise HTTPException(status_code=400, detail="Image download failed.")
-            else:
-                raise HTTPException(status_code=400, detail="Provide either image_file or image_url for image search.")
+            image_path = save_query_image(image_file, image_url)
 
             # Call multimodel search using the image path
             status, query_result, msg = multimodel_search(
                 query=image_path,
                 video_url=video_url,
-                n_results=n_results,
+                n_results=n_candidates,
                 search_query_type="image",
-                output_from=output_from
+                output_from=output_from,
+                fusion=fusion,
+                timings=timings
             )
 
         else:
@@ -82,13 +216,13 @@ def search_video(
         if not status:
             raise HTTPException(status_code=500, detail=msg)
 
-        timestamps = []
-        for tmp in query_result["metadatas"][0]:
-            start_time = tmp["start"]
-            tmp_timestamp = convert_seconds_to_time_str(start_time)
-            timestamps.append(tmp_timestamp)
+        with timed_phase(search_phase_seconds, "post_processing", timings):
+            response = format_search_result(query_result, n_results, merge, merge_gap_sec)
 
-        return {"status": "success", "results": timestamps}
+        if timing:
+            timings["total"] = round((time.perf_counter() - request_start) * 1000, 3)
+            response["timing_ms"] = timings
+        return response
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal error: {str(e)}")
@@ -98,5 +232,165 @@ def search_video(
             os.remove(image_path)
 
 
+@app.post("/search/global")
+def search_library(
+    search_query_type: Literal["text", "image"] = Form(...),
+    output_from: Literal["text", "image", "both"] = Form("both"),
+    n_results: int = Form(10),
+    ef_search: Optional[int] = Form(None),
+    candidate_multiplier: int = Form(GLOBAL_CANDIDATE_MULTIPLIER),
+    max_per_video: int = Form(GLOBAL_MAX_HITS_PER_VIDEO),
+    channel: Optional[str] = Form(None),
+    min_duration: Optional[float] = Form(None),
+    max_duration: Optional[float] = Form(None),
+    ingested_after: Optional[str] = Form(None),
+    ingested_before: Optional[str] = Form(None),
+    timing: bool = Form(False),
+    query: Optional[str] = Form(None),
+    image_url: Optional[str] = Form(None),
+    image_file: Optional[UploadFile] = File(None)
+):
+    image_path = None
+    timings = {}
+    request_start = time.perf_counter()
+
+    try:
+        if search_query_type == "text":
+            if not query:
+                raise HTTPException(status_code=400, detail="Text query not provided.")
+        else:
+            image_path = save_query_image(image_file, image_url)
+            query = image_path
+
+        filters = {
+            "channel": channel,
+            "min_duration": min_duration,
+            "max_duration": max_duration,
+            "ingested_after": parse_date(ingested_after),
+            "ingested_before": parse_date(ingested_before),
+        }
+        status, groups, msg = global_search(
+            query=query,
+            search_query_type=search_query_type,
+            n_results=n_results,
+            output_from=output_from,
+            ef_search=ef_search,
+            candidate_multiplier=candidate_multiplier,
+            max_per_video=max_per_video,
+            filters=filters,
+            timings=timings
+        )
+        if not status:
+            raise HTTPException(status_code=500, detail=msg)
+
+        for group in groups:
+            for hit in group["hits"]:
+                hit["timestamp"] = convert_seconds_to_time_str(hit["start"])
+
+        response = {"status": "success", "videos": groups}
+        if timing:
+            timings["total"] = round((time.perf_counter() - request_start) * 1000, 3)
+            response["timing_ms"] = timings
+        return response
+
+    except HTTPException:
+        # Bad input keeps its 400 instead of becoming an internal error
+        raise
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal error: {str(e)}")
+
+    finally:
+        if image_path and os.path.exists(image_path):
+            os.remove(image_path)
+
+
+class BatchQuery(BaseModel):
+    # Echoed back so results can be matched to queries
+    id: Optional[str] = None
+    query: Optional[str] = None
+    image_url: Optional[str] = None
+
+
+class BatchSearchRequest(BaseModel):
+    queries: List[BatchQuery]
+    video_urls: List[str]
+    n_results: int = 5
+    output_from: Literal["text", "image", "both"] = "both"
+    fusion: Literal["rrf", "score"] = "rrf"
+    merge: bool = True
+    merge_gap_sec: float = MERGE_GAP_SEC
+
+
+def prepare_batch_query(tmp_query, image_paths):
+    # Downloaded images go to `image_paths` so they are removed even when invalid
+    if tmp_query.query:
+        return {"type": "text", "query": tmp_query.query}
+    if tmp_query.image_url:
+        image_paths.append(save_query_image(None, tmp_query.image_url))
+        # Reject undecodable downloads here, where they only fail their own query
+        with Image.open(image_paths[-1]) as image:
+            image.verify()
+        return {"type": "image", "query": image_paths[-1]}
+    raise Exception("Query has neither query nor image_url")
+
+
+def batch_error_line(index, tmp_query, e):
+    detail = e.detail if isinstance(e, HTTPException) else str(e)
+    return json.dumps({"status": "error", "index": index, "id": tmp_query.id, "message": f"Error: {detail}"}) + "\n"
+
+
+def iter_batch_search(request):
+    """
+    NDJSON lines, one per (query, video), produced BATCH_SEARCH_CHUNK queries at a
+    time so the first results go out before the last queries are encoded. A query
+    that cannot be prepared gets a single error line and the rest of its chunk is
+    still searched.
+    """
+    n_candidates = request.n_results * MERGE_OVERFETCH if request.merge else request.n_results
+    for chunk_start in range(0, len(request.queries), BATCH_SEARCH_CHUNK):
+        chunk = request.queries[chunk_start:chunk_start + BATCH_SEARCH_CHUNK]
+        image_paths = []
+        try:
+            # Positions in `chunk` of the queries sent to batch_search
+            positions = []
+            queries = []
+            for position, tmp_query in enumerate(chunk):
+                try:
+                    queries.append(prepare_batch_query(tmp_query, image_paths))
+                    positions.append(position)
+                except Exception as e:
+                    # The stream has already started, so failures are reported in-band
+                    yield batch_error_line(chunk_start + position, tmp_query, e)
+
+            if not queries:
+                continue
+
+            try:
+                outputs = batch_search(queries, request.video_urls, n_candidates, output_from=request.output_from, fusion=request.fusion)
+                # Format everything first, so a query never gets results and then an error
+                lines = []
+                for index, video_url, query_result in outputs:
+                    position = positions[index]
+                    line = format_search_result(query_result, request.n_results, request.merge, request.merge_gap_sec)
+                    line.update({"index": chunk_start + position, "id": chunk[position].id, "video_url": video_url})
+                    lines.append(json.dumps(line) + "\n")
+            except Exception as e:
+                lines = [batch_error_line(chunk_start + position, chunk[position], e) for position in positions]
+            yield from lines
+
+        finally:
+            for image_path in image_paths:
+                if os.path.exists(image_path):
+                    os.remove(image_path)
+
+
+@app.post("/search/batch")
+def search_batch(request: BatchSearchRequest):
+    if not request.video_urls:
+        raise HTTPException(status_code=400, detail="No video_urls provided.")
+    return StreamingResponse(iter_batch_search(request), media_type="application/x-ndjson")
+
+
 if __name__ == "__main__":
     uvicorn.run(app=app, port=8000)
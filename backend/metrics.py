@@ -0,0 +1,119 @@
+import time
+import threading
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from a single query up to a multi-hour ingest
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+registry = []
+
+
+def format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + list(extra or [])
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    """
+    Monotonic counter in the Prometheus text format, one series per label values.
+    """
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram in the Prometheus text format.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, series in sorted(self.series.items()):
+                for bound, count in zip(self.buckets, series["buckets"]):
+                    lines.append(f"{self.name}_bucket{format_labels(self.labelnames, key, [('le', bound)])} {count}")
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, key, [('le', '+Inf')])} {series['count']}")
+                lines.append(f"{self.name}_sum{format_labels(self.labelnames, key)} {round(series['sum'], 6)}")
+                lines.append(f"{self.name}_count{format_labels(self.labelnames, key)} {series['count']}")
+        return lines
+
+
+ingest_stage_seconds = Histogram("ingest_stage_seconds", "Wall time of each ingest pipeline stage", ["stage"])
+ingest_stage_total = Counter("ingest_stage_total", "Ingest pipeline stages by outcome", ["stage", "status"])
+ingest_phase_seconds = Histogram("ingest_phase_seconds", "Time spent in one call of an ingest phase inside a stage", ["phase"])
+ingest_items_total = Counter("ingest_items_total", "Items processed by ingest phases", ["phase"])
+search_phase_seconds = Histogram("search_phase_seconds", "Time spent in each phase of a search request", ["phase"])
+search_requests_total = Counter("search_requests_total", "Search requests by query type, output and result cache outcome", ["search_query_type", "output_from", "cache"])
+
+
+@contextmanager
+def timed_phase(histogram, phase, timings=None):
+    """
+    Observe the time spent in the block under `phase`, and add it (in ms) to the
+    `timings` dict when one is given, for per-request breakdowns.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        histogram.observe(elapsed, phase=phase)
+        if timings is not None:
+            timings[phase] = round(timings.get(phase, 0.0) + elapsed * 1000, 3)
+
+
+def record_stage_report(report):
+    # Per-stage results of pipeline.run_stages
+    for name, stage_report in report.items():
+        ingest_stage_total.inc(stage=name, status=stage_report["status"])
+        if stage_report["status"] != "skipped":
+            ingest_stage_seconds.observe(stage_report["elapsed"], stage=name)
+
+
+def render_metrics():
+    lines = []
+    for metric in registry:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
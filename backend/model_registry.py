@@ -0,0 +1,125 @@
+import os
+import threading
+import time
+
+# "search" workers only ever load CLIP, "ingest" and "all" also load Whisper
+SERVICE_ROLE = os.environ.get("SERVICE_ROLE", "all")
+
+ROLE_MODELS = {
+    "search": ["clip"],
+    "ingest": ["clip", "whisper"],
+    "all": ["clip", "whisper"],
+}
+
+if SERVICE_ROLE not in ROLE_MODELS:
+    raise Exception(f"Unrecognized SERVICE_ROLE: {SERVICE_ROLE}")
+
+CLIP_MODEL_NAME = "ViT-B/32"
+# "torch" (fp32 PyTorch), "onnx" (ONNX Runtime fp32) or "onnx-int8" (dynamic int8);
+# the ONNX variants need `python clip_onnx.py export` to have been run
+CLIP_BACKEND = os.environ.get("CLIP_BACKEND", "torch")
+
+WHISPER_MODEL_SIZE = "distil-large-v3"
+# WHISPER_MODEL_SIZE = "small"
+# 0 lets CTranslate2 pick; transcription worker processes lower it to share the cores
+WHISPER_CPU_THREADS = int(os.environ.get("WHISPER_CPU_THREADS", "0"))
+
+models = {}
+load_times = {}
+model_locks = {name: threading.Lock() for name in ("clip", "whisper")}
+ready = False
+
+
+def load_clip():
+    if CLIP_BACKEND in ("onnx", "onnx-int8"):
+        from clip_onnx import load_onnx_clip
+        return load_onnx_clip(quantized=CLIP_BACKEND == "onnx-int8")
+    if CLIP_BACKEND != "torch":
+        raise Exception(f"Unrecognized CLIP_BACKEND: {CLIP_BACKEND}")
+
+    import clip
+    import torch
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    return clip.load(CLIP_MODEL_NAME, device=device)
+
+
+def load_whisper():
+    from faster_whisper import WhisperModel
+
+    return WhisperModel(WHISPER_MODEL_SIZE, device="cpu", compute_type="int8", cpu_threads=WHISPER_CPU_THREADS)
+
+
+MODEL_LOADERS = {
+    "clip": load_clip,
+    "whisper": load_whisper,
+}
+
+
+def can_ingest():
+    return "whisper" in ROLE_MODELS[SERVICE_ROLE]
+
+
+def get_model(name):
+    """
+    Return the model registered under `name`, loading it on first use.
+    """
+    if name not in ROLE_MODELS[SERVICE_ROLE]:
+        raise Exception(f"Model {name} is not available in the {SERVICE_ROLE} role")
+
+    model = models.get(name)
+    if model is None:
+        with model_locks[name]:
+            model = models.get(name)
+            if model is None:
+                start = time.perf_counter()
+                model = MODEL_LOADERS[name]()
+                load_times[name] = round(time.perf_counter() - start, 3)
+                models[name] = model
+                print(f"[INFO] Loaded {name} model in {load_times[name]}s")
+    return model
+
+
+def get_clip_model():
+    # (model, preprocess)
+    return get_model("clip")
+
+
+def get_whisper_model():
+    return get_model("whisper")
+
+
+def warm_up():
+    """
+    Load every model of the current role and run one small inference through it,
+    so the first real request does not pay for loading or lazy initialization.
+    """
+    global ready
+    try:
+        import numpy as np
+
+        for name in ROLE_MODELS[SERVICE_ROLE]:
+            if name == "clip":
+                from image_text_emb import get_text_embbeding
+                status, _, message = get_text_embbeding(["warm up"])
+                if not status:
+                    raise Exception(message)
+            elif name == "whisper":
+                segments, info = get_whisper_model().transcribe(np.zeros(16000, dtype=np.float32), beam_size=1, language="en")
+                list(segments)
+
+        ready = True
+        return True, "Success"
+    except Exception as e:
+        return False, f"Error: {e}"
+
+
+def registry_status():
+    return {
+        "role": SERVICE_ROLE,
+        "clip_backend": CLIP_BACKEND,
+        "ready": ready,
+        "models": ROLE_MODELS[SERVICE_ROLE],
+        "loaded": sorted(models),
+        "load_times": dict(load_times),
+    }
@@ -0,0 +1,106 @@
+import multiprocessing
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+
+def run_stages(stages, executor="thread", max_workers=None, on_event=None):
+    """
+    Run a small DAG of stages, starting each stage as soon as its dependencies finish.
+
+    Each stage is a dict with:
+    - name (str): unique stage name
+    - func (callable): called as func(*args, *results_of_deps); raise to fail the stage
+    - args (tuple): optional fixed arguments
+    - deps (list): optional names of stages whose results are passed to func
+    - local (bool): always run in a thread of this process, even in "process" mode
+      (use it for stages that write to the database or consume generators)
+
+    When a stage fails, the stages depending on it are skipped while independent
+    branches keep running. `on_event(name, event, info)` is called with "pending"
+    for every stage up front, then "started", "success", "failed" or "skipped".
+
+    Returns (status, results, report) where report maps each stage name to
+    {"status", "message", "elapsed"}.
+    """
+    if executor not in ("thread", "process"):
+        raise Exception(f"Unrecognized executor: {executor}")
+
+    by_name = {stage["name"]: stage for stage in stages}
+    for stage in stages:
+        for dep in stage.get("deps", []):
+            if dep not in by_name:
+                raise Exception(f"Stage {stage['name']} depends on unknown stage {dep}")
+
+    max_workers = max_workers or len(stages)
+    results = {}
+    report = {}
+    running = {}
+    started_at = {}
+
+    def notify(name, event, info=None):
+        if on_event is not None:
+            try:
+                on_event(name, event, info or {})
+            except Exception as e:
+                print(f"[WARN] Stage event handler failed: {e}")
+
+    thread_pool = ThreadPoolExecutor(max_workers=max_workers)
+    process_pool = None
+    if executor == "process":
+        process_pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    for stage in stages:
+        notify(stage["name"], "pending")
+
+    try:
+        while len(report) < len(stages):
+            progressed = False
+            for stage in stages:
+                name = stage["name"]
+                if name in report or name in running.values():
+                    continue
+
+                deps = stage.get("deps", [])
+                failed_deps = [dep for dep in deps if dep in report and report[dep]["status"] != "success"]
+                if failed_deps:
+                    report[name] = {"status": "skipped", "message": f"Skipped because {', '.join(failed_deps)} failed", "elapsed": 0.0}
+                    notify(name, "skipped", report[name])
+                    progressed = True
+                    continue
+
+                if all(dep in results for dep in deps):
+                    pool = thread_pool if (process_pool is None or stage.get("local")) else process_pool
+                    args = tuple(stage.get("args", ())) + tuple(results[dep] for dep in deps)
+                    started_at[name] = time.perf_counter()
+                    running[pool.submit(stage["func"], *args)] = name
+                    notify(name, "started")
+                    progressed = True
+
+            if not running:
+                if progressed:
+                    continue
+                # Nothing running and nothing can start: the remaining stages wait on each other
+                for stage in stages:
+                    if stage["name"] not in report:
+                        report[stage["name"]] = {"status": "failed", "message": "Error: dependency cycle", "elapsed": 0.0}
+                break
+
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                elapsed = round(time.perf_counter() - started_at[name], 3)
+                try:
+                    results[name] = future.result()
+                    report[name] = {"status": "success", "message": "Success", "elapsed": elapsed}
+                    notify(name, "success", report[name])
+                except Exception as e:
+                    report[name] = {"status": "failed", "message": f"Error: {e}", "elapsed": elapsed}
+                    print(f"[ERROR] Stage {name} failed: {e}")
+                    notify(name, "failed", report[name])
+    finally:
+        thread_pool.shutdown(wait=True)
+        if process_pool is not None:
+            process_pool.shutdown(wait=True)
+
+    status = all(stage_report["status"] == "success" for stage_report in report.values())
+    return status, results, report
@@ -0,0 +1,125 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from image_text_emb import get_text_embbeding, get_image_embbeding
+
+# Longest time the first query of a batch waits for others to join it
+QUERY_BATCH_MAX_WAIT_MS = float(os.environ.get("QUERY_BATCH_MAX_WAIT_MS", "5"))
+# Largest number of queries encoded in one forward pass
+QUERY_BATCH_MAX_SIZE = int(os.environ.get("QUERY_BATCH_MAX_SIZE", "32"))
+# Set to 0 to encode every query on the calling thread
+QUERY_BATCHING = os.environ.get("QUERY_BATCHING", "1") == "1"
+
+
+class QueryBatcher:
+    """
+    Collects concurrent encode requests for up to `max_wait_ms`, encodes them with a
+    single `encode_batch(items)` call and hands each caller its own result.
+    """
+
+    def __init__(self, name, encode_batch, max_batch=QUERY_BATCH_MAX_SIZE, max_wait_ms=QUERY_BATCH_MAX_WAIT_MS):
+        self.name = name
+        self.encode_batch = encode_batch
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self.requests = queue.Queue()
+        self.worker = None
+        self.worker_lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+
+    def encode(self, item, timeout=None):
+        return self.submit(item).result(timeout=timeout)
+
+    def submit(self, item):
+        self.start()
+        future = Future()
+        self.requests.put((item, future))
+        return future
+
+    def start(self):
+        with self.worker_lock:
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.run, name=f"{self.name}-batcher", daemon=True)
+                self.worker.start()
+
+    def run(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.monotonic() + self.max_wait_ms / 1000
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            # Identical queries in one batch are encoded once
+            unique_items = list(dict.fromkeys(item for item, _ in batch))
+            try:
+                results = dict(zip(unique_items, self.encode_batch(unique_items)))
+            except Exception as e:
+                # One bad item (e.g. an unreadable image) must not fail the others,
+                # so the batch is retried one item at a time
+                results = {unique_items[0]: e}
+                if len(unique_items) > 1:
+                    for item in unique_items:
+                        try:
+                            results[item] = self.encode_batch([item])[0]
+                        except Exception as item_error:
+                            results[item] = item_error
+
+            for item, future in batch:
+                if isinstance(results[item], Exception):
+                    future.set_exception(results[item])
+                else:
+                    future.set_result(results[item])
+
+            self.batches += 1
+            self.items += len(batch)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+def encode_text_batch(texts):
+    status, text_emb, message = get_text_embbeding(texts)
+    if not status:
+        raise Exception(message)
+    return text_emb.tolist()
+
+
+def encode_image_batch(image_paths):
+    status, image_emb, message = get_image_embbeding(image_paths)
+    if not status:
+        raise Exception(message)
+    return [tmp.tolist() for tmp in image_emb]
+
+
+text_batcher = QueryBatcher("text_query", encode_text_batch)
+image_batcher = QueryBatcher("image_query", encode_image_batch)
+
+
+def encode_text_query(text):
+    if not QUERY_BATCHING:
+        return encode_text_batch([text])[0]
+    return text_batcher.encode(text)
+
+
+def encode_image_query(image_path):
+    if not QUERY_BATCHING:
+        return encode_image_batch([image_path])[0]
+    return image_batcher.encode(image_path)
+
+
+def query_encoder_stats():
+    return {batcher.name: batcher.stats() for batcher in (text_batcher, image_batcher)}
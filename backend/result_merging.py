@@ -0,0 +1,76 @@
+import os
+
+# Hits closer than this on the timeline are merged into one range
+MERGE_GAP_SEC = float(os.environ.get("MERGE_GAP_SEC", "10"))
+# Candidates fetched per returned range, so merging still leaves n_results ranges
+MERGE_OVERFETCH = int(os.environ.get("MERGE_OVERFETCH", "4"))
+# "max" ranks a range by its best hit, "sum" also rewards ranges with many hits
+MERGE_SCORE = os.environ.get("MERGE_SCORE", "max")
+
+
+def result_hits(query_result):
+    """
+    Flatten a query-shaped result (optionally fused, with "scores") into hit dicts
+    with a score where higher is better.
+    """
+    hits = []
+    for index, (tmp_id, metadata, distance) in enumerate(zip(query_result["ids"][0], query_result["metadatas"][0], query_result["distances"][0])):
+        score = query_result["scores"][0][index] if "scores" in query_result else 1 - distance
+        hits.append({
+            "id": tmp_id,
+            "obj": metadata["obj"],
+            "start": metadata["start"],
+            "end": max(metadata.get("end", metadata["start"]), metadata["start"]),
+            "scene": metadata.get("scene"),
+            "distance": distance,
+            "score": score,
+        })
+    return hits
+
+
+def same_moment(cluster, hit, gap_sec):
+    if hit["start"] - cluster["end"] > gap_sec:
+        return False
+    # Scenes only narrow a range: close frames across a cut stay apart, while text
+    # hits and ranges without frames go by the gap alone
+    return hit["scene"] is None or not cluster["scenes"] or hit["scene"] in cluster["scenes"]
+
+
+def merge_hits(query_result, n_results, gap_sec=MERGE_GAP_SEC, aggregate=MERGE_SCORE):
+    """
+    Cluster the hits of one video on the timeline and return the best `n_results`
+    [start, end] ranges.
+
+    Hits join a range when they start within `gap_sec` of its end and, for frames,
+    come from one of its scenes. Each range keeps its best hit and a score aggregated over its hits
+    with `aggregate` ("max" or "sum").
+    """
+    if aggregate not in ("max", "sum"):
+        raise Exception(f"Unrecognized score aggregation: {aggregate}")
+
+    clusters = []
+    for hit in sorted(result_hits(query_result), key=lambda hit: (hit["start"], hit["end"])):
+        if clusters and same_moment(clusters[-1], hit, gap_sec):
+            cluster = clusters[-1]
+            cluster["end"] = max(cluster["end"], hit["end"])
+            cluster["hits"].append(hit)
+        else:
+            cluster = {"start": hit["start"], "end": hit["end"], "hits": [hit], "scenes": set()}
+            clusters.append(cluster)
+        if hit["scene"] is not None:
+            cluster["scenes"].add(hit["scene"])
+
+    ranges = []
+    for cluster in clusters:
+        scores = [hit["score"] for hit in cluster["hits"]]
+        best = max(cluster["hits"], key=lambda hit: hit["score"])
+        ranges.append({
+            "start": cluster["start"],
+            "end": cluster["end"],
+            "score": round(max(scores) if aggregate == "max" else sum(scores), 6),
+            "num_hits": len(cluster["hits"]),
+            "best": {key: best[key] for key in ("id", "obj", "start", "distance", "score")},
+        })
+
+    ranges.sort(key=lambda tmp: tmp["score"], reverse=True)
+    return ranges[:n_results]
@@ -0,0 +1,118 @@
+import hashlib
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache bounded by entry count and approximate size in bytes,
+    with a per-entry time to live.
+    """
+
+    def __init__(self, name, max_entries, max_bytes, ttl_sec):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_sec = ttl_sec
+        self.entries = OrderedDict()  # key -> (value, size, expires_at)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[2] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, size, time.monotonic() + self.ttl_sec)
+            self.total_bytes += size
+
+            while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, predicate):
+        with self.lock:
+            for key in [key for key in self.entries if predicate(key)]:
+                self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_sec": self.ttl_sec,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def _remove(self, key):
+        # Caller holds self.lock
+        value, size, expires_at = self.entries.pop(key)
+        self.total_bytes -= size
+
+
+def estimate_size(value):
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    try:
+        return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return 1024
+
+
+def normalize_text_query(text):
+    # CLIP's tokenizer lower-cases and collapses whitespace, so these map to the same embedding
+    return " ".join(text.split()).lower()
+
+
+def hash_file(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+text_emb_cache = LRUCache("text_embedding", max_entries=4096, max_bytes=32 * 1024 * 1024, ttl_sec=24 * 3600)
+image_emb_cache = LRUCache("image_embedding", max_entries=1024, max_bytes=16 * 1024 * 1024, ttl_sec=3600)
+# Result keys start with the video_url so a re-ingest or delete can drop them
+result_cache = LRUCache("search_result", max_entries=2048, max_bytes=64 * 1024 * 1024, ttl_sec=600)
+
+
+def invalidate_video(video_url):
+    result_cache.invalidate(lambda key: key[0] == video_url)
+
+
+def cache_stats():
+    return {cache.name: cache.stats() for cache in (text_emb_cache, image_emb_cache, result_cache)}
@@ -1,39 +1,349 @@
-from chromadb_functions import get_text_embbeding, collection, client, get_image_embeddings_batch
+import os
+from concurrent.futures import ThreadPoolExecutor
 
+from chromadb_functions import collection, client
+from query_encoder import encode_text_query, encode_image_query, encode_text_batch, encode_image_batch
+from search_cache import text_emb_cache, image_emb_cache, result_cache, normalize_text_query, hash_file
+from metrics import timed_phase, search_phase_seconds, search_requests_total
+from video_index import query_video_index
 
-def multimodel_search(query, video_url, n_results, search_query_type=["text", "image"], output_from=["text", "image", "both"]):
+# Reciprocal rank fusion constant; larger values flatten the advantage of the top ranks
+RRF_K = 60
+# Text and image hits starting within this many seconds of the previous hit are fused into one moment
+FUSION_WINDOW_SEC = 2
+# "chroma" queries the shared HNSW index with a video filter, "exact" scores the
+# video's own memory-mapped embedding matrices
+SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND", "chroma")
+# Global search fetches this many times n_results candidates, so capping the hits per
+# video still leaves n_results moments
+GLOBAL_CANDIDATE_MULTIPLIER = int(os.environ.get("GLOBAL_CANDIDATE_MULTIPLIER", "4"))
+GLOBAL_MAX_HITS_PER_VIDEO = 3
+# Queries encoded and sent to the vector store together by the batch search
+BATCH_SEARCH_CHUNK = int(os.environ.get("BATCH_SEARCH_CHUNK", "256"))
+
+search_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="search")
+
+
+def query_video_obj(query_emb, video_url, n_results, obj, backend=SEARCH_BACKEND):
+    if backend == "exact":
+        return query_video_index(query_emb, video_url, n_results, obj)
+    if backend != "chroma":
+        raise Exception(f"Unrecognized search backend: {backend}")
+
+    return collection.query(
+        query_embeddings=query_emb,
+        n_results=n_results,
+        where={
+            "$and": [
+                {"obj": obj},
+                {"video_url": video_url},
+            ]
+        }
+    )
+
+
+def fuse_results(results_by_obj, n_results, fusion="rrf", window_sec=FUSION_WINDOW_SEC):
+    """
+    Fuse per-modality query results into one ranked list.
+
+    Hits are clustered on the timeline, like merge_hits does: a hit joins the
+    current moment when it starts within `window_sec` of the moment's last hit.
+    Each modality contributes its best score for the moment, either 1 / (RRF_K + rank) for "rrf" or the
+    min-max normalized similarity for "score". Returns a query-shaped result with
+    "scores" and "sources" (the hits behind every fused moment) added.
+    """
+    if fusion not in ("rrf", "score"):
+        raise Exception(f"Unrecognized fusion method: {fusion}")
+
+    hits = []
+    for obj, result in results_by_obj.items():
+        distances = result["distances"][0]
+        if not distances:
+            continue
+        similarities = [1 - distance for distance in distances]
+        low, high = min(similarities), max(similarities)
+
+        for rank, (tmp_id, metadata, distance, similarity) in enumerate(zip(result["ids"][0], result["metadatas"][0], distances, similarities)):
+            if fusion == "rrf":
+                score = 1 / (RRF_K + rank + 1)
+            else:
+                score = (similarity - low) / (high - low) if high > low else 1.0
+
+            hits.append((metadata["start"], obj, rank, tmp_id, metadata, distance, score))
+
+    moments = []
+    for start, obj, rank, tmp_id, metadata, distance, score in sorted(hits, key=lambda hit: hit[0]):
+        if not moments or start - moments[-1]["end"] > window_sec:
+            moments.append({"end": start, "scores": {}, "best": None, "sources": []})
+        moment = moments[-1]
+        moment["end"] = start
+        moment["scores"][obj] = max(moment["scores"].get(obj, 0.0), score)
+        moment["sources"].append({"obj": obj, "id": tmp_id, "rank": rank, "distance": distance})
+        if moment["best"] is None or score > moment["best"][3]:
+            moment["best"] = (tmp_id, metadata, distance, score)
+
+    ranked = sorted(moments, key=lambda moment: sum(moment["scores"].values()), reverse=True)[:n_results]
+    return {
+        "ids": [[moment["best"][0] for moment in ranked]],
+        "metadatas": [[moment["best"][1] for moment in ranked]],
+        "distances": [[moment["best"][2] for moment in ranked]],
+        "scores": [[round(sum(moment["scores"].values()), 6) for moment in ranked]],
+        "sources": [[moment["sources"] for moment in ranked]],
+    }
+
+
+def get_query_embedding(query, search_query_type):
+    """
+    Return (status, query_key, embedding, message), serving repeated queries from cache.
+
+    Text queries are keyed by their normalized text, image queries by a hash of the file.
+    """
     try:
         if search_query_type == "text":
-            tmp_emb_status, tmp_text_emb, tmp_message = get_text_embbeding(query)
-            tmp_text_emb = tmp_text_emb.tolist()
+            query_key = normalize_text_query(query)
+            query_emb = text_emb_cache.get(query_key)
+            if query_emb is None:
+                # Concurrent queries are micro-batched into one CLIP forward pass
+                query_emb = [encode_text_query(query)]
+                text_emb_cache.set(query_key, query_emb)
         elif search_query_type == "image":
-            tmp_emb_status, tmp_text_emb, tmp_message = get_image_embeddings_batch([query])
+            query_key = hash_file(query)
+            query_emb = image_emb_cache.get(query_key)
+            if query_emb is None:
+                query_emb = [encode_image_query(query)]
+                image_emb_cache.set(query_key, query_emb)
         else:
             raise Exception("Unrecognize search query type")
 
+        return True, query_key, query_emb, "Success"
+    except Exception as e:
+        return False, None, None, f"Error: {e}"
+
+
+def multimodel_search(query, video_url, n_results, search_query_type=["text", "image"], output_from=["text", "image", "both"], fusion="rrf", timings=None):
+    """
+    When a `timings` dict is given, the time spent in each phase is added to it in ms.
+    """
+    try:
+        with timed_phase(search_phase_seconds, "query_embedding", timings):
+            tmp_emb_status, query_key, tmp_text_emb, tmp_message = get_query_embedding(query, search_query_type)
         if tmp_emb_status == False:
-            raise Exception("Error in generate text embedding")
+            raise Exception(tmp_message)
         if not client:
             raise Exception("Error in establish connection with database")
+
+        result_key = (video_url, search_query_type, query_key, n_results, output_from, fusion)
+        query_result = result_cache.get(result_key)
+        search_requests_total.inc(search_query_type=search_query_type, output_from=output_from, cache="hit" if query_result is not None else "miss")
+        if query_result is not None:
+            return True, query_result, "Success"
         
         if output_from == "both":
-            query_result = collection.query(
-                query_embeddings=tmp_text_emb,
-                n_results=n_results,
-                where={"obj": "text"},
-            )
-        elif output_from == "text" or output_from == "image":
-            query_result = collection.query(
-                query_embeddings=tmp_text_emb,
-                n_results=n_results,
-                where={
-                    "$and": [
-                        {"obj": output_from},
-                        {"video_url": video_url},
-                    ]
+            # Query both modalities of this video concurrently, then fuse the ranked lists
+            with timed_phase(search_phase_seconds, "vector_query", timings):
+                futures = {
+                    obj: search_pool.submit(query_video_obj, tmp_text_emb, video_url, n_results, obj)
+                    for obj in ("text", "image")
                 }
-            )
+                results_by_obj = {obj: future.result() for obj, future in futures.items()}
+            with timed_phase(search_phase_seconds, "post_processing", timings):
+                query_result = fuse_results(results_by_obj, n_results, fusion=fusion)
+        elif output_from == "text" or output_from == "image":
+            with timed_phase(search_phase_seconds, "vector_query", timings):
+                query_result = query_video_obj(tmp_text_emb, video_url, n_results, output_from)
+        else:
+            raise Exception("Unrecognize output from")
 
+        result_cache.set(result_key, query_result)
         return True, query_result, "Success"
     except Exception as e:
-        return False, None, f"Error: {e}"
\ No newline at end of file
+        return False, None, f"Error: {e}"
+
+
+def build_metadata_filter(obj=None, channel=None, min_duration=None, max_duration=None, ingested_after=None, ingested_before=None):
+    """
+    Chroma `where` clause for the global search filters; durations are in seconds and
+    ingest times in epoch seconds.
+    """
+    conditions = []
+    if obj is not None:
+        conditions.append({"obj": obj})
+    if channel:
+        conditions.append({"channel": channel})
+    if min_duration is not None:
+        conditions.append({"duration": {"$gte": float(min_duration)}})
+    if max_duration is not None:
+        conditions.append({"duration": {"$lte": float(max_duration)}})
+    if ingested_after is not None:
+        conditions.append({"ingested_at": {"$gte": int(ingested_after)}})
+    if ingested_before is not None:
+        conditions.append({"ingested_at": {"$lte": int(ingested_before)}})
+
+    if not conditions:
+        return None
+    if len(conditions) == 1:
+        return conditions[0]
+    return {"$and": conditions}
+
+
+def group_hits_by_video(hits, n_results, max_per_video=GLOBAL_MAX_HITS_PER_VIDEO):
+    """
+    Keep the best `n_results` hits with at most `max_per_video` from any one video,
+    grouped per video and ordered by each video's best hit.
+    """
+    groups = {}
+    kept = 0
+    for hit in sorted(hits, key=lambda hit: hit["score"], reverse=True):
+        if kept >= n_results:
+            break
+        group = groups.setdefault(hit["video_url"], {"video_url": hit["video_url"], "best_score": hit["score"], "hits": []})
+        if len(group["hits"]) >= max_per_video:
+            continue
+        group["hits"].append(hit)
+        kept += 1
+
+    return [group for group in groups.values() if group["hits"]]
+
+
+def global_search(query, search_query_type, n_results=10, output_from="both", ef_search=None, candidate_multiplier=GLOBAL_CANDIDATE_MULTIPLIER, max_per_video=GLOBAL_MAX_HITS_PER_VIDEO, filters=None, timings=None):
+    """
+    Top `n_results` moments across the whole library, grouped per video.
+
+    The HNSW index searches with a candidate list of at least the number of results
+    asked for, so `ef_search` and `candidate_multiplier` both widen the search:
+    max(ef_search, n_results * candidate_multiplier) candidates are fetched per
+    modality, trading latency for recall. `filters` takes the keyword arguments of
+    build_metadata_filter except obj. Returns (status, groups, message).
+    """
+    try:
+        if output_from == "both":
+            objs = ["text", "image"]
+        elif output_from == "text" or output_from == "image":
+            objs = [output_from]
+        else:
+            raise Exception("Unrecognize output from")
+
+        with timed_phase(search_phase_seconds, "query_embedding", timings):
+            tmp_emb_status, query_key, query_emb, tmp_message = get_query_embedding(query, search_query_type)
+        if tmp_emb_status == False:
+            raise Exception(tmp_message)
+
+        n_candidates = max(ef_search or 0, n_results * candidate_multiplier, n_results)
+        with timed_phase(search_phase_seconds, "vector_query", timings):
+            futures = {
+                obj: search_pool.submit(
+                    collection.query,
+                    query_embeddings=query_emb,
+                    n_results=n_candidates,
+                    where=build_metadata_filter(obj=obj, **(filters or {}))
+                )
+                for obj in objs
+            }
+            results_by_obj = {obj: future.result() for obj, future in futures.items()}
+
+        with timed_phase(search_phase_seconds, "post_processing", timings):
+            hits = []
+            for obj, result in results_by_obj.items():
+                for rank, (tmp_id, metadata, distance) in enumerate(zip(result["ids"][0], result["metadatas"][0], result["distances"][0])):
+                    # Text-text and text-image similarities are on different scales,
+                    # so both modalities are ranked with reciprocal rank fusion
+                    score = 1 / (RRF_K + rank + 1) if len(objs) > 1 else 1 - distance
+                    hit = {
+                        "id": tmp_id,
+                        "video_url": metadata["video_url"],
+                        "obj": obj,
+                        "start": metadata["start"],
+                        "distance": distance,
+                        "score": round(score, 6),
+                    }
+                    if "end" in metadata:
+                        hit["end"] = metadata["end"]
+                    if "text" in metadata:
+                        hit["text"] = metadata["text"]
+                    hits.append(hit)
+
+            groups = group_hits_by_video(hits, n_results, max_per_video=max_per_video)
+
+        return True, groups, "Success"
+    except Exception as e:
+        return False, None, f"Error: {e}"
+
+
+def get_query_embeddings_batch(queries):
+    """
+    Embeddings for a list of {"type": "text"|"image", "query": text or image path}
+    dicts, in order. Cache misses of each type are encoded in one forward pass.
+    """
+    keys = []
+    embs = [None] * len(queries)
+    missing = {"text": {}, "image": {}}
+    for index, tmp_query in enumerate(queries):
+        if tmp_query["type"] == "text":
+            key, cache = normalize_text_query(tmp_query["query"]), text_emb_cache
+        elif tmp_query["type"] == "image":
+            key, cache = hash_file(tmp_query["query"]), image_emb_cache
+        else:
+            raise Exception("Unrecognize search query type")
+        keys.append(key)
+
+        cached = cache.get(key)
+        if cached is not None:
+            embs[index] = cached[0]
+        else:
+            missing[tmp_query["type"]].setdefault(key, []).append(index)
+
+    for query_type, encode_batch, cache in (("text", encode_text_batch, text_emb_cache), ("image", encode_image_batch, image_emb_cache)):
+        if not missing[query_type]:
+            continue
+        # One input per distinct query; duplicates share the embedding
+        inputs = [queries[indexes[0]]["query"] for indexes in missing[query_type].values()]
+        for (key, indexes), emb in zip(missing[query_type].items(), encode_batch(inputs)):
+            cache.set(key, [emb])
+            for index in indexes:
+                embs[index] = emb
+    return embs
+
+
+def batch_search(queries, video_urls, n_results, output_from="both", fusion="rrf", timings=None):
+    """
+    Search every query against every video with one multi-embedding vector query
+    per video and modality.
+
+    Returns a list of (query_index, video_url, query_result) in query-major order,
+    with query_result shaped like multimodel_search's result.
+    """
+    if output_from == "both":
+        objs = ["text", "image"]
+    elif output_from == "text" or output_from == "image":
+        objs = [output_from]
+    else:
+        raise Exception("Unrecognize output from")
+
+    with timed_phase(search_phase_seconds, "query_embedding", timings):
+        query_embs = get_query_embeddings_batch(queries)
+
+    with timed_phase(search_phase_seconds, "vector_query", timings):
+        futures = {
+            (video_url, obj): search_pool.submit(query_video_obj, query_embs, video_url, n_results, obj)
+            for video_url in video_urls
+            for obj in objs
+        }
+        results = {key: future.result() for key, future in futures.items()}
+
+    with timed_phase(search_phase_seconds, "post_processing", timings):
+        outputs = []
+        for index in range(len(queries)):
+            for video_url in video_urls:
+                # Row `index` of each multi-query result belongs to this query
+                results_by_obj = {
+                    obj: {field: [results[(video_url, obj)][field][index]] for field in ("ids", "metadatas", "distances")}
+                    for obj in objs
+                }
+                if len(objs) > 1:
+                    query_result = fuse_results(results_by_obj, n_results, fusion=fusion)
+                else:
+                    query_result = results_by_obj[objs[0]]
+                outputs.append((index, video_url, query_result))
+
+    search_requests_total.inc(len(outputs), search_query_type="batch", output_from=output_from, cache="miss")
+    return outputs
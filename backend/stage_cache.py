@@ -0,0 +1,193 @@
+import os
+import json
+import pickle
+import shutil
+import hashlib
+import tempfile
+import threading
+
+# Persistent results of ingest stages, so a retried ingest resumes where it stopped
+STAGE_CACHE_DIR = os.environ.get("STAGE_CACHE_DIR", "./stage_cache")
+STAGE_CACHE_MAX_BYTES = int(os.environ.get("STAGE_CACHE_MAX_BYTES", str(20 * 1024 ** 3)))
+# Set to 0 to always recompute every stage
+STAGE_CACHE_ENABLED = os.environ.get("STAGE_CACHE_ENABLED", "1") == "1"
+
+cache_lock = threading.Lock()
+# Videos being ingested right now; their entries are never evicted
+videos_in_use = {}
+
+
+def video_key(video_url):
+    return hashlib.sha256(video_url.encode("utf-8")).hexdigest()[:32]
+
+
+def entry_path(video_url, stage, params=None, suffix=".pkl"):
+    """
+    Path of the entry for `stage` of `video_url` computed with `params`; any change
+    in the parameters gives a different entry.
+    """
+    params_hash = hashlib.sha256(json.dumps(params or {}, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(STAGE_CACHE_DIR, video_key(video_url), f"{stage}-{params_hash}{suffix}")
+
+
+def touch(path):
+    # Entries are evicted by last access time, tracked through the mtime
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def get(video_url, stage, params=None):
+    """
+    Returns (hit, value).
+    """
+    if not STAGE_CACHE_ENABLED:
+        return False, None
+
+    path = entry_path(video_url, stage, params)
+    try:
+        with open(path, "rb") as f:
+            value = pickle.load(f)
+    except FileNotFoundError:
+        return False, None
+    except Exception as e:
+        print(f"[WARN] Dropping unreadable stage cache entry {path}: {e}")
+        remove_entry(path)
+        return False, None
+
+    touch(path)
+    return True, value
+
+
+def put(video_url, stage, value, params=None):
+    if not STAGE_CACHE_ENABLED:
+        return
+
+    path = entry_path(video_url, stage, params)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temp file and rename, so a crash never leaves a truncated entry
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except Exception:
+        remove_entry(tmp_path)
+        raise
+    evict()
+
+
+def get_file(video_url, stage, params=None, suffix=".mp4"):
+    """
+    Path of a cached file, or None.
+    """
+    if not STAGE_CACHE_ENABLED:
+        return None
+
+    path = entry_path(video_url, stage, params, suffix=suffix)
+    if not os.path.exists(path):
+        return None
+    touch(path)
+    return path
+
+
+def put_file(video_url, stage, file_path, params=None, suffix=".mp4"):
+    """
+    Move `file_path` into the cache and return its new path. When the cache is
+    disabled the file stays where it is.
+    """
+    if not STAGE_CACHE_ENABLED:
+        return file_path
+
+    path = entry_path(video_url, stage, params, suffix=suffix)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    shutil.move(file_path, tmp_path)
+    os.replace(tmp_path, path)
+    evict()
+    return path
+
+
+def remove_entry(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def list_entries():
+    entries = []
+    if not os.path.isdir(STAGE_CACHE_DIR):
+        return entries
+    for key in os.listdir(STAGE_CACHE_DIR):
+        video_dir = os.path.join(STAGE_CACHE_DIR, key)
+        if not os.path.isdir(video_dir):
+            continue
+        for name in os.listdir(video_dir):
+            path = os.path.join(video_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, key, path))
+    return entries
+
+
+def evict(max_bytes=STAGE_CACHE_MAX_BYTES):
+    """
+    Remove least recently used entries until the cache fits in `max_bytes`.
+    Entries of videos that are being ingested are kept.
+    """
+    with cache_lock:
+        entries = sorted(list_entries())
+        total = sum(size for _, size, _, _ in entries)
+        removed = 0
+        for mtime, size, key, path in entries:
+            if total <= max_bytes:
+                break
+            if key in videos_in_use:
+                continue
+            remove_entry(path)
+            total -= size
+            removed += 1
+
+        if removed:
+            print(f"[INFO] Evicted {removed} stage cache entries, {total} bytes left")
+        return removed
+
+
+class using_video:
+    """
+    Context manager that protects a video's entries from eviction while it is
+    being ingested.
+    """
+
+    def __init__(self, video_url):
+        self.key = video_key(video_url)
+
+    def __enter__(self):
+        with cache_lock:
+            videos_in_use[self.key] = videos_in_use.get(self.key, 0) + 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        with cache_lock:
+            videos_in_use[self.key] -= 1
+            if not videos_in_use[self.key]:
+                del videos_in_use[self.key]
+
+
+def clear_video(video_url):
+    shutil.rmtree(os.path.join(STAGE_CACHE_DIR, video_key(video_url)), ignore_errors=True)
+
+
+def stage_cache_stats():
+    entries = list_entries()
+    return {
+        "enabled": STAGE_CACHE_ENABLED,
+        "entries": len(entries),
+        "videos": len({key for _, _, key, _ in entries}),
+        "bytes": sum(size for _, size, _, _ in entries),
+        "max_bytes": STAGE_CACHE_MAX_BYTES,
+    }
@@ -0,0 +1,70 @@
+import os
+
+# Token budget of one window; CLIP sees at most 75 text tokens
+CHUNK_MAX_TOKENS = int(os.environ.get("CHUNK_MAX_TOKENS", "64"))
+# Tokens of trailing segments repeated at the start of the next window
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("CHUNK_OVERLAP_TOKENS", "16"))
+# A pause longer than this always starts a new window
+CHUNK_MAX_GAP_SEC = float(os.environ.get("CHUNK_MAX_GAP_SEC", "5"))
+
+
+def clip_token_count(text):
+    from clip.clip import _tokenizer
+
+    return len(_tokenizer.encode(text))
+
+
+def chunk_transcript(text_segments, max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS, max_gap_sec=CHUNK_MAX_GAP_SEC, count_tokens=clip_token_count):
+    """
+    Merge Whisper segments into sliding windows of at most `max_tokens` tokens.
+
+    Windows are built from whole segments; each one starts with the trailing segments
+    of the previous window that fit in `overlap_tokens`, so a sentence cut at a
+    window boundary is still searchable as a whole. A segment longer than the budget
+    becomes a window of its own. Returns dicts with start, end, text and segments
+    (the number of Whisper segments merged).
+    """
+    segments = [
+        (segment, count_tokens(segment["text"]))
+        for segment in text_segments
+        if segment["text"].strip()
+    ]
+
+    windows = []
+    current = []
+    used = 0
+
+    def close_window():
+        windows.append({
+            "start": current[0][0]["start"],
+            "end": current[-1][0]["end"],
+            "text": " ".join(segment["text"] for segment, _ in current),
+            "segments": len(current),
+        })
+
+    for segment, tokens in segments:
+        if current:
+            gap = segment["start"] - current[-1][0]["end"]
+            if used + tokens > max_tokens or gap > max_gap_sec:
+                close_window()
+
+                # Carry the tail of the closed window over, unless there was a pause
+                carried = []
+                carried_tokens = 0
+                if gap <= max_gap_sec:
+                    for previous in reversed(current):
+                        if carried_tokens + previous[1] > overlap_tokens or carried_tokens + previous[1] + tokens > max_tokens:
+                            break
+                        carried.insert(0, previous)
+                        carried_tokens += previous[1]
+                current = carried
+                used = carried_tokens
+
+        current.append((segment, tokens))
+        used += tokens
+
+    if current:
+        close_window()
+
+    print(f"[INFO] Chunked {len(segments)} transcript segments into {len(windows)} windows.")
+    return windows
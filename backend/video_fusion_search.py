@@ -1,12 +1,39 @@
 import tempfile
 import shutil
+import time
 import os
 
-from download_video import download_video
-from audio_processing import extract_audio
-from extract_text import extract_text
-from chromadb_functions import save_text_emb_in_db, save_img_emb_in_db, check_url_in_db
-from extract_scenes_from_video import extract_frames_per_scene
+from pipeline import run_stages
+from download_video import get_video_details
+from ingest_stages import download_stage, probe_stage, extract_audio_stage, transcribe_stage, stream_transcribe_stage, embed_frames_stage
+from chromadb_functions import save_text_emb_in_db, save_frame_batches_in_db, get_video_modalities, delete_video_emb_from_db, mark_modality_complete
+from extract_scenes_from_video import iter_frames_per_scene, DEFAULT_SAMPLING_POLICY
+from image_text_emb import get_frame_embeddings_batch
+from frame_dedup import dedup_frames, DEDUP_MAX_DISTANCE
+from extract_text import TRANSCRIBE_OPTIONS
+from model_registry import CLIP_MODEL_NAME, CLIP_BACKEND, WHISPER_MODEL_SIZE
+import stage_cache
+from metrics import record_stage_report
+from video_index import build_video_index, delete_video_index
+from transcript_chunking import chunk_transcript
+from search_cache import invalidate_video
+from search_functions import SEARCH_BACKEND
+
+# Set to a folder to keep the sampled keyframes as JPEGs; frames go straight to CLIP otherwise
+KEYFRAMES_DIR = None
+# Drop near-duplicate frames (static slides, talking heads) before CLIP encoding
+FRAME_DEDUP = os.environ.get("FRAME_DEDUP", "1") == "1"
+# Store overlapping token-budget windows of the transcript instead of raw Whisper segments
+TEXT_CHUNKING = os.environ.get("TEXT_CHUNKING", "1") == "1"
+# Per-scene frame budgets from scene length and motion, capped per video
+SAMPLING_POLICY = dict(DEFAULT_SAMPLING_POLICY)
+
+# "thread" runs the audio and visual branches in threads of this process, "process"
+# runs the compute stages in worker processes
+PIPELINE_EXECUTOR = os.environ.get("PIPELINE_EXECUTOR", "thread")
+PIPELINE_MAX_WORKERS = int(os.environ.get("PIPELINE_MAX_WORKERS", "4"))
+# Pipe raw PCM from ffmpeg into Whisper; set to 0 to go through a temp WAV file
+AUDIO_STREAMING = os.environ.get("AUDIO_STREAMING", "1") == "1"
 
 def convert_seconds_to_time_str(seconds):
     seconds = int(seconds)
@@ -15,48 +42,209 @@ def convert_seconds_to_time_str(seconds):
     secs = seconds % 60
     return f"{hours:02}:{minutes:02}:{secs:02}"
 
-def video_audio_fusion_search(video_url):
+def transcript_cache_params():
+    # Anything that changes the transcript invalidates the cached one
+    return {"whisper": WHISPER_MODEL_SIZE, "options": TRANSCRIBE_OPTIONS}
+
+def frames_cache_params():
+    return {
+        "clip": CLIP_MODEL_NAME,
+        "backend": CLIP_BACKEND,
+        "policy": SAMPLING_POLICY,
+        "dedup": FRAME_DEDUP,
+        "dedup_max_distance": DEDUP_MAX_DISTANCE,
+    }
+
+def cached_download_stage(video_url, temp_dir):
+    video_file_path = stage_cache.get_file(video_url, "download")
+    if video_file_path:
+        print(f"[INFO] Using cached download of {video_url}")
+        return video_file_path
+    return stage_cache.put_file(video_url, "download", download_stage(video_url, temp_dir))
+
+def cached_result_stage(value):
+    return value
+
+def video_details_stage(video_url):
+    """
+    Metadata stored with every vector of the video, used by the global search filters.
+    """
+    hit, details = stage_cache.get(video_url, "details")
+    if not hit:
+        status, details = get_video_details(video_url)
+        if not status:
+            # Filters cannot match this video, but search inside it still works
+            print(f"[WARN] Could not fetch the details of {video_url}")
+            details = {"channel": "", "title": "", "duration": 0.0}
+        else:
+            stage_cache.put(video_url, "details", details)
+
+    return {
+        "channel": details["channel"],
+        "duration": details["duration"],
+        "ingested_at": int(time.time()),
+    }
+
+def finish_modality(video_url, obj, save_status, save_message, count):
+    """
+    Mark a modality complete once all its vectors are written, or drop the partial
+    vectors of a failed write so they are never searched.
+    """
+    if not save_status:
+        delete_video_emb_from_db(video_url, obj=obj)
+        raise Exception(f"Saving {obj} embeddings failed: {save_message}")
+    mark_status, mark_message = mark_modality_complete(video_url, obj, count)
+    if not mark_status:
+        raise Exception(f"Marking {obj} embeddings complete failed: {mark_message}")
+
+def save_text_stage(video_url, cache_params, text_segments, video_details):
+    if cache_params is not None:
+        stage_cache.put(video_url, "transcribe", text_segments, cache_params)
+    # Drop vectors left behind by an earlier attempt that failed half way
+    delete_video_emb_from_db(video_url, obj="text")
+    if TEXT_CHUNKING:
+        text_segments = chunk_transcript(text_segments)
+    save_text_emb_status, save_text_emb_message = save_text_emb_in_db(text_segments, video_url, extra_metadata=video_details)
+    # A video without speech is complete with no text vectors
+    finish_modality(video_url, "text", save_text_emb_status, save_text_emb_message, len(text_segments))
+
+def save_frames_stage(video_url, cache_params, emb_batches, video_details):
+    if cache_params is not None:
+        stage_cache.put(video_url, "embed_frames", emb_batches, cache_params)
+    delete_video_emb_from_db(video_url, obj="image")
+    save_img_emb_status, save_img_emb_message = save_frame_batches_in_db(emb_batches, video_url, extra_metadata=video_details)
+    finish_modality(video_url, "image", save_img_emb_status, save_img_emb_message, sum(len(batch_metadata) for batch_metadata, _ in emb_batches))
+
+def stream_frames_stage(video_url, cache_params, video_file_path, video_details):
+    # Extraction, encoding and writes overlap, frame batches are never held all at once
+    frame_stream = iter_frames_per_scene(video_file_path, output_dir=KEYFRAMES_DIR, policy=SAMPLING_POLICY)
+    if FRAME_DEDUP:
+        frame_stream = dedup_frames(frame_stream)
+
+    # Embeddings are small next to the frames, keep them for the stage cache
+    emb_batches = []
+    encoded_all = False
+
+    def record(batches):
+        nonlocal encoded_all
+        for batch in batches:
+            emb_batches.append(batch)
+            yield batch
+        encoded_all = True
+
+    delete_video_emb_from_db(video_url, obj="image")
+    save_img_emb_status, save_img_emb_message = save_frame_batches_in_db(record(get_frame_embeddings_batch(frame_stream)), video_url, extra_metadata=video_details)
+    # Cache before checking the write, so a retry after a failed write skips encoding;
+    # a stream that stopped half way is not worth caching
+    if encoded_all:
+        stage_cache.put(video_url, "embed_frames", emb_batches, cache_params)
+    finish_modality(video_url, "image", save_img_emb_status, save_img_emb_message, sum(len(batch_metadata) for batch_metadata, _ in emb_batches))
+
+def build_ingest_stages(video_url, temp_dir, executor=PIPELINE_EXECUTOR, audio_streaming=AUDIO_STREAMING, modalities=("text", "image")):
+    """
+    Stages that write the missing `modalities` of a video. Stages whose result is in
+    the stage cache are replaced by the cached value, and the download is skipped
+    when nothing left needs the video file.
+    """
+    stages = [
+        {"name": "details", "func": video_details_stage, "args": (video_url,), "local": True},
+    ]
+    needs_download = False
+
+    # Audio branch: Extract Audio -> Extract Text -> Save Text Embeddings
+    if "text" in modalities:
+        transcript_params = transcript_cache_params()
+        hit, text_segments = stage_cache.get(video_url, "transcribe", transcript_params)
+        if hit:
+            print(f"[INFO] Using cached transcript of {video_url}")
+            stages.append({"name": "transcribe", "func": cached_result_stage, "args": (text_segments,), "local": True})
+            transcript_params = None
+        elif audio_streaming:
+            stages.append({"name": "transcribe", "func": stream_transcribe_stage, "deps": ["download", "probe"]})
+            needs_download = True
+        else:
+            stages += [
+                {"name": "extract_audio", "func": extract_audio_stage, "args": (temp_dir,), "deps": ["download"]},
+                {"name": "transcribe", "func": transcribe_stage, "deps": ["extract_audio"]},
+            ]
+            needs_download = True
+        stages.append({"name": "save_text_emb", "func": save_text_stage, "args": (video_url, transcript_params), "deps": ["transcribe", "details"], "local": True})
+
+    # Visual branch: Extract Frames per Scene -> Save Image Embeddings
+    if "image" in modalities:
+        frames_params = frames_cache_params()
+        hit, emb_batches = stage_cache.get(video_url, "embed_frames", frames_params)
+        if hit:
+            print(f"[INFO] Using cached frame embeddings of {video_url}")
+            stages += [
+                {"name": "embed_frames", "func": cached_result_stage, "args": (emb_batches,), "local": True},
+                {"name": "save_img_emb", "func": save_frames_stage, "args": (video_url, None), "deps": ["embed_frames", "details"], "local": True},
+            ]
+        elif executor == "process":
+            stages += [
+                {"name": "embed_frames", "func": embed_frames_stage, "args": (KEYFRAMES_DIR, FRAME_DEDUP, SAMPLING_POLICY), "deps": ["download"]},
+                {"name": "save_img_emb", "func": save_frames_stage, "args": (video_url, frames_params), "deps": ["embed_frames", "details"], "local": True},
+            ]
+            needs_download = True
+        else:
+            stages.append(
+                {"name": "save_img_emb", "func": stream_frames_stage, "args": (video_url, frames_params), "deps": ["download", "details"], "local": True}
+            )
+            needs_download = True
+
+    if needs_download:
+        stages = [
+            # Step 1: Download Video
+            {"name": "download", "func": cached_download_stage, "args": (video_url, temp_dir), "local": True},
+            {"name": "probe", "func": probe_stage, "deps": ["download"], "local": True},
+        ] + stages
+    return stages
+
+def refresh_video_index(video_url):
+    # Keep the exact search matrices in line with the vector store
+    if SEARCH_BACKEND == "exact":
+        status, counts, message = build_video_index(video_url)
+        if not status:
+            print(f"[WARN] Rebuilding the video index failed, it is rebuilt on the next search: {message}")
+            delete_video_index(video_url)
+    else:
+        delete_video_index(video_url)
+
+def missing_modalities(video_url):
+    """
+    Modalities that still have to be ingested. Each modality counts as done only
+    once its completion marker is written, so a branch that failed after some of
+    its batches were flushed is ingested again.
+    """
+    status, present, message = get_video_modalities(video_url)
+    if not status:
+        raise Exception(message)
+
+    return [obj for obj in ("text", "image") if not present[obj]]
+
+def video_audio_fusion_search(video_url, executor=PIPELINE_EXECUTOR, max_workers=PIPELINE_MAX_WORKERS, on_event=None):
     # Create a temporary directory
     temp_dir = tempfile.mkdtemp()
 
     try:
-        check_url_status, is_url_present, check_url_message = check_url_in_db(video_url)
-        if is_url_present:
+        modalities = missing_modalities(video_url)
+        if not modalities:
             return True, "Success"
 
-        # Step 1: Download Video
-        video_download_status, video_file_path = download_video(video_url, output_path=temp_dir)
-        if not video_download_status:
-            raise Exception("Video is not downloaded.")
-
-        # Step 2: Extract Audio
-        output_audio_path = os.path.join(temp_dir, "output_audio.wav")
-        audio_convert_status, audio_file_path = extract_audio(video_file_path, output_audio_path=output_audio_path)
-        if not audio_convert_status:
-            raise Exception("Audio extraction failed.")
-
-        # Step 3: Extract Text
-        extract_text_status, text_segments, full_text, message = extract_text(audio_file_path)
-        if not extract_text_status:
-            raise Exception(f"Text extraction failed: {message}")
-
-        # Step 4: Save Text Embeddings
-        save_text_emb_status, save_text_emb_message = save_text_emb_in_db(text_segments, video_url)
-        if not save_text_emb_status:
-            raise Exception(f"Saving text embeddings failed: {save_text_emb_message}")
-
-        # Step 5: Extract Frames per Scene
-        scenes_tmp_folder = os.path.join(temp_dir, "scenes")
-        extract_frames_status, scenes_folder_path, scenes_csv_path, scenes_create_message = extract_frames_per_scene(
-            video_file_path, output_dir=scenes_tmp_folder, fps=0.5, save_csv=True
-        )
-        if not extract_frames_status:
-            raise Exception(f"Scene frame extraction failed: {scenes_create_message}")
-
-        # Step 6: Save Image Embeddings
-        save_img_emb_status, save_img_emb_message = save_img_emb_in_db(scenes_folder_path, scenes_csv_path, video_url)
-        if not save_img_emb_status:
-            raise Exception(f"Saving image embeddings failed: {save_img_emb_message}")
+        with stage_cache.using_video(video_url):
+            stages = build_ingest_stages(video_url, temp_dir, executor=executor, modalities=modalities)
+            status, results, report = run_stages(stages, executor=executor, max_workers=max_workers, on_event=on_event)
+        record_stage_report(report)
+        # Cached results for this video are stale once new vectors have been written
+        invalidate_video(video_url)
+        refresh_video_index(video_url)
+        if not status:
+            failed = [
+                f"{name}: {stage_report['message']}"
+                for name, stage_report in report.items()
+                if stage_report["status"] == "failed"
+            ]
+            raise Exception("; ".join(failed))
 
         return True, "Success"
 
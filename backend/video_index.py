@@ -0,0 +1,245 @@
+import os
+import json
+import uuid
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from chromadb_functions import collection
+
+# Per-video embedding matrices answered by brute force, exact and independent of corpus size
+VIDEO_INDEX_DIR = os.environ.get("VIDEO_INDEX_DIR", "./video_index")
+# Precision of the matrix scanned for every query: "float32" is exact, "float16" and
+# "int8" (per-vector scale) cut the resident memory 2x and 4x, and their top
+# candidates are re-ranked with the float32 copy kept on disk. numpy converts int8
+# to float32 far faster than float16, so int8 is also the faster of the two.
+# Only used with SEARCH_BACKEND=exact: the default chroma backend with float32 saves
+# no memory, every vector stays in the float32 HNSW index.
+VIDEO_INDEX_DTYPE = os.environ.get("VIDEO_INDEX_DTYPE", "float32")
+# Candidates re-ranked in float32, as a multiple of n_results
+RERANK_MULTIPLIER = int(os.environ.get("RERANK_MULTIPLIER", "4"))
+# Rows converted to float32 at a time while scanning a quantized matrix
+SCAN_CHUNK_ROWS = 4096
+# Videos whose matrices stay mapped at the same time
+VIDEO_INDEX_MAX_LOADED = int(os.environ.get("VIDEO_INDEX_MAX_LOADED", "256"))
+
+index_lock = threading.Lock()
+# video_url -> (build id, {obj: {"matrix", "scales", "full", "ids", "metadatas"}})
+loaded_indexes = OrderedDict()
+
+
+def video_index_dir(video_url):
+    return os.path.join(VIDEO_INDEX_DIR, hashlib.sha256(video_url.encode("utf-8")).hexdigest()[:32])
+
+
+def read_build_id(folder):
+    # Every build writes a new id, so a process can tell that another one rebuilt the index
+    try:
+        with open(os.path.join(folder, "build_id")) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def empty_video_index():
+    return {
+        obj: {"matrix": np.zeros((0, 0), dtype=np.float32), "scales": None, "full": None, "ids": [], "metadatas": []}
+        for obj in ("text", "image")
+    }
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def quantize_rows(matrix, dtype):
+    """
+    Returns (quantized matrix, per-row scales or None). int8 uses a symmetric scale
+    per vector, so rows with small values keep their resolution.
+    """
+    if dtype == "float32":
+        return matrix.astype(np.float32), None
+    if dtype == "float16":
+        return matrix.astype(np.float16), None
+    if dtype == "int8":
+        if matrix.size == 0:
+            # A modality without vectors has nothing to take a maximum over
+            return matrix.astype(np.int8), np.zeros(len(matrix), dtype=np.float32)
+        scales = np.maximum(np.abs(matrix).max(axis=1), 1e-12) / 127
+        return np.round(matrix / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    raise Exception(f"Unrecognized video index dtype: {dtype}")
+
+
+def build_video_index(video_url, dtype=VIDEO_INDEX_DTYPE):
+    """
+    Write the normalized text and image embeddings of a video from the Chroma store
+    to one contiguous .npy matrix per modality, with ids and metadatas alongside.
+    Quantized matrices also get a float32 copy for re-ranking. A video without
+    vectors gets no index on disk.
+    """
+    try:
+        tmp_dir = f"{video_index_dir(video_url)}.tmp-{uuid.uuid4().hex}"
+        os.makedirs(tmp_dir)
+
+        counts = {}
+        for obj in ("text", "image"):
+            result = collection.get(
+                where={"$and": [{"video_url": video_url}, {"obj": obj}]},
+                include=["embeddings", "metadatas"]
+            )
+            embeddings = np.asarray(result["embeddings"], dtype=np.float32)
+            if len(embeddings) == 0:
+                embeddings = np.zeros((0, 0), dtype=np.float32)
+            embeddings = normalize_rows(embeddings)
+            matrix, scales = quantize_rows(embeddings, dtype)
+            np.save(os.path.join(tmp_dir, f"{obj}.npy"), matrix)
+            if scales is not None:
+                np.save(os.path.join(tmp_dir, f"{obj}.scale.npy"), scales)
+            if dtype != "float32":
+                np.save(os.path.join(tmp_dir, f"{obj}.f32.npy"), embeddings.astype(np.float32))
+            with open(os.path.join(tmp_dir, f"{obj}.json"), "w") as f:
+                json.dump({"ids": result["ids"], "metadatas": result["metadatas"]}, f)
+            counts[obj] = len(result["ids"])
+
+        if not any(counts.values()):
+            # Unknown or deleted video, searching it must not leave an index behind
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            delete_video_index(video_url)
+            return True, counts, "Success"
+
+        with open(os.path.join(tmp_dir, "build_id"), "w") as f:
+            f.write(uuid.uuid4().hex)
+
+        # Swap the whole folder so a reader never sees text and image from different builds
+        with index_lock:
+            shutil.rmtree(video_index_dir(video_url), ignore_errors=True)
+            os.replace(tmp_dir, video_index_dir(video_url))
+            loaded_indexes.pop(video_url, None)
+
+        print(f"[INFO] Built video index of {video_url}: {counts}")
+        return True, counts, "Success"
+    except Exception as e:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return False, None, f"Error: {e}"
+
+
+def delete_video_index(video_url):
+    with index_lock:
+        loaded_indexes.pop(video_url, None)
+        shutil.rmtree(video_index_dir(video_url), ignore_errors=True)
+
+
+def load_video_index(video_url):
+    """
+    The video's index, mapped once per build. The build id on disk is checked on
+    every call, so ingests and deletes done by other processes are picked up.
+    """
+    folder = video_index_dir(video_url)
+    build_id = read_build_id(folder)
+    with index_lock:
+        loaded = loaded_indexes.get(video_url)
+        if loaded is not None and build_id is not None and loaded[0] == build_id:
+            loaded_indexes.move_to_end(video_url)
+            return loaded[1]
+
+    if build_id is None:
+        # Videos ingested before this index existed (or by an older build) are built on first use
+        status, counts, message = build_video_index(video_url)
+        if not status:
+            raise Exception(message)
+        build_id = read_build_id(folder)
+        if build_id is None:
+            return empty_video_index()
+
+    index = {}
+    for obj in ("text", "image"):
+        # Only the (possibly quantized) matrix is scanned on every query; of the float32
+        # copy just the re-ranked rows are ever paged in
+        matrix = np.load(os.path.join(folder, f"{obj}.npy"), mmap_mode="r")
+        scale_path = os.path.join(folder, f"{obj}.scale.npy")
+        full_path = os.path.join(folder, f"{obj}.f32.npy")
+        with open(os.path.join(folder, f"{obj}.json")) as f:
+            entries = json.load(f)
+        index[obj] = {
+            "matrix": matrix,
+            "scales": np.load(scale_path) if os.path.exists(scale_path) else None,
+            "full": np.load(full_path, mmap_mode="r") if os.path.exists(full_path) else None,
+            "ids": entries["ids"],
+            "metadatas": entries["metadatas"],
+        }
+
+    with index_lock:
+        loaded_indexes[video_url] = (build_id, index)
+        while len(loaded_indexes) > VIDEO_INDEX_MAX_LOADED:
+            loaded_indexes.popitem(last=False)
+    return index
+
+
+def top_k(scores, k):
+    # argpartition is linear in the number of vectors; only the k winners get sorted
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def scan_scores(matrix, scales, query):
+    if matrix.dtype == np.float32:
+        return matrix @ query
+    # numpy has no BLAS path for float16 or int8, so rows are converted a chunk at a time
+    scores = np.empty(len(matrix), dtype=np.float32)
+    for start in range(0, len(matrix), SCAN_CHUNK_ROWS):
+        scores[start:start + SCAN_CHUNK_ROWS] = matrix[start:start + SCAN_CHUNK_ROWS].astype(np.float32) @ query
+    if scales is not None:
+        scores *= scales
+    return scores
+
+
+def query_video_index(query_emb, video_url, n_results, obj, rerank_multiplier=RERANK_MULTIPLIER):
+    """
+    Cosine search over one modality of one video. Takes and returns the same shapes
+    as collection.query, with cosine distances. Quantized matrices pick
+    n_results * rerank_multiplier candidates, which are re-scored in float32.
+    """
+    index = load_video_index(video_url)[obj]
+    ids, metadatas = index["ids"], index["metadatas"]
+    query = normalize_rows(np.asarray(query_emb, dtype=np.float32))
+
+    result = {"ids": [], "metadatas": [], "distances": []}
+    for tmp_query in query:
+        best, best_scores = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        if len(ids):
+            scores = scan_scores(index["matrix"], index["scales"], tmp_query)
+            if index["full"] is None:
+                best = top_k(scores, n_results)
+                best_scores = scores[best]
+            else:
+                candidates = np.sort(top_k(scores, n_results * rerank_multiplier))
+                exact_scores = np.asarray(index["full"][candidates]) @ tmp_query
+                order = top_k(exact_scores, n_results)
+                best, best_scores = candidates[order], exact_scores[order]
+
+        result["ids"].append([ids[i] for i in best])
+        result["metadatas"].append([metadatas[i] for i in best])
+        result["distances"].append([float(1 - score) for score in best_scores])
+    return result
+
+
+def video_index_stats():
+    with index_lock:
+        return {
+            "loaded": len(loaded_indexes),
+            "max_loaded": VIDEO_INDEX_MAX_LOADED,
+            "dtype": VIDEO_INDEX_DTYPE,
+            # Memory the scanned matrices need to stay in the page cache
+            "scanned_bytes": sum(
+                entry["matrix"].nbytes + (entry["scales"].nbytes if entry["scales"] is not None else 0)
+                for _, index in loaded_indexes.values()
+                for entry in index.values()
+            ),
+        }
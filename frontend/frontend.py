@@ -1,9 +1,11 @@
+import time
 import streamlit as st
 import requests
 import urllib.parse
 import streamlit.components.v1 as components
 
 API_URL = "http://localhost:8000"  # Backend endpoint
+JOB_POLL_INTERVAL = 2  # Seconds between embedding job status checks
 
 st.set_page_config(page_title="Multimodal Video Search", layout="centered")
 st.title("🎬 Multimodal Video Search")
@@ -26,16 +28,37 @@ if st.button("Generate Embeddings"):
     if not embed_url.strip():
         st.warning("Please enter a valid YouTube URL.")
     else:
-        with st.spinner("Generating embeddings..."):
-            res = requests.post(f"{API_URL}/embed", data={"url": embed_url})
-            if res.status_code == 200:
-                st.success("Embeddings created successfully.")
-                st.session_state.embedding_done = True
-                st.session_state.video_url = embed_url
-                st.session_state.last_results = []
-                st.session_state.selected_timestamp = None
-            else:
-                st.error(f"Embedding failed: {res.json().get('detail', 'Unknown error')}")
+        res = requests.post(f"{API_URL}/embed", data={"url": embed_url})
+        if res.status_code != 200:
+            st.error(f"Embedding failed: {res.json().get('detail', 'Unknown error')}")
+        else:
+            job_id = res.json()["job_id"]
+            progress_bar = st.progress(0.0, text="Embedding job queued...")
+
+            # Poll the job until the backend reports it finished
+            while True:
+                job_res = requests.get(f"{API_URL}/jobs/{job_id}")
+                if job_res.status_code != 200:
+                    st.error(f"Embedding failed: {job_res.json().get('detail', 'Unknown error')}")
+                    break
+
+                job = job_res.json()
+                running_stages = [name for name, stage in job["stages"].items() if stage["status"] == "running"]
+                progress_text = f"Running: {', '.join(running_stages)}" if running_stages else job["status"].capitalize()
+                progress_bar.progress(job["progress"], text=progress_text)
+
+                if job["status"] == "success":
+                    st.success(f"Embeddings created successfully in {job['elapsed']:.0f}s.")
+                    st.session_state.embedding_done = True
+                    st.session_state.video_url = embed_url
+                    st.session_state.last_results = []
+                    st.session_state.selected_timestamp = None
+                    break
+                if job["status"] == "failed":
+                    st.error(f"Embedding failed: {job['message']}")
+                    break
+
+                time.sleep(JOB_POLL_INTERVAL)
 
 # -------- Step 2: Search --------
 st.header("Step 2: Search Video Content")
@@ -87,7 +110,9 @@ if st.button("Search"):
             response = requests.post(f"{API_URL}/search", data=data, files=files)
 
             if response.status_code == 200:
-                timestamps = response.json().get("results", [])
+                # Merged time ranges avoid near-identical timestamps of one moment
+                ranges = response.json().get("ranges")
+                timestamps = [tmp["start_timestamp"] for tmp in ranges] if ranges else response.json().get("results", [])
                 st.session_state.last_results = timestamps
                 st.session_state.selected_timestamp = None
                 if not timestamps: